@@ -0,0 +1,17 @@
+# The Python API. aws_jumpcloud.api imports boto3 and the keyring libraries,
+# so it's only imported when used, to keep the command line tool fast.
+
+
+class LoginError(Exception):
+    """Raised when aws-jumpcloud can't get AWS credentials for a profile, e.g.
+    because the profile doesn't exist, or logging in needs an MFA code but
+    there's no terminal to ask for one."""
+
+
+def get_boto3_session(profile_name, region_name=None):
+    """Returns a boto3 Session that uses the profile's temporary AWS
+    credentials. The credentials come from the OS keychain, logging in if
+    necessary, and are refreshed the same way shortly before they expire, so
+    the Session can be used for as long as the process runs."""
+    from aws_jumpcloud.api import get_boto3_session as get
+    return get(profile_name, region_name)
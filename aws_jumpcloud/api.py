@@ -0,0 +1,47 @@
+from datetime import timedelta
+
+import boto3
+from botocore.credentials import RefreshableCredentials
+from botocore.session import get_session as get_botocore_session
+
+from aws_jumpcloud import LoginError
+from aws_jumpcloud import commands
+
+# botocore refreshes credentials in the background once they expire within
+# the advisory timeout, and blocks requests to refresh them once they expire
+# within the mandatory timeout. A refresh asks the keychain first, and only
+# logs in again if the keychain's session expires within REFRESH_MARGIN too.
+ADVISORY_REFRESH_TIMEOUT = 5 * 60  # in seconds
+MANDATORY_REFRESH_TIMEOUT = 2 * 60  # in seconds
+REFRESH_MARGIN = timedelta(seconds=ADVISORY_REFRESH_TIMEOUT)
+
+
+class JumpCloudCredentials(RefreshableCredentials):
+    _advisory_refresh_timeout = ADVISORY_REFRESH_TIMEOUT
+    _mandatory_refresh_timeout = MANDATORY_REFRESH_TIMEOUT
+
+
+def get_boto3_session(profile_name, region_name=None):
+    refresh = _credential_fetcher(profile_name)
+    credentials = JumpCloudCredentials.create_from_metadata(
+        metadata=refresh(), refresh_using=refresh, method="aws-jumpcloud")
+    botocore_session = get_botocore_session()
+    botocore_session._credentials = credentials
+    return boto3.Session(botocore_session=botocore_session, region_name=region_name)
+
+
+def _credential_fetcher(profile_name):
+    # Returns a function that gets the profile's AWS session, in the form
+    # that RefreshableCredentials expects
+    def fetch():
+        try:
+            session = commands._get_aws_session(profile_name, min_lifetime=REFRESH_MARGIN)
+        except SystemExit as e:
+            # The reason has already been printed to stderr
+            raise LoginError(f"Couldn't get AWS credentials for profile \"{profile_name}\" "
+                             f"(exit code {e.code}).") from None
+        return {"access_key": session.access_key_id,
+                "secret_key": session.secret_access_key,
+                "token": session.session_token,
+                "expiry_time": session.expires_at.isoformat()}
+    return fetch
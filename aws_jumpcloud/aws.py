@@ -2,12 +2,15 @@ import base64
 from collections import namedtuple
 from datetime import datetime, timedelta, timezone
 import json
+import os
 import re
 import time
 
-import boto3
-
+from aws_jumpcloud.query_client import DEFAULT_TIMEOUT, AWSConnectionError, AWSRequestError, QueryClient, \
+    parse_timestamp
 from aws_jumpcloud.saml import get_assertion_duration
+from aws_jumpcloud.scheduler import get_scheduler
+from aws_jumpcloud.sts_endpoints import DEFAULT_ENDPOINT, GLOBAL_ENDPOINT, report_failure
 
 # Regular expression to extract an account number and role name from an ARN.
 ROLE_ARN_REGEXP = re.compile(r"^arn:aws:iam::([0-9]{12}):role/([\w+=,.@-]+)$")
@@ -21,8 +24,34 @@ ParseResult = namedtuple("ArnParts", ["aws_account_id", "aws_role"])
 # AWS MaxSessionDuration!)
 DEFAULT_DURATION = 60 * 60  # in seconds
 
+# A profile can instead ask for the longest session its role allows. STS
+# rejects a DurationSeconds longer than the role's MaxSessionDuration (at most
+# 12 hours), or longer than 1 hour when chaining roles, with a
+# ValidationError, so we try these durations from longest to shortest.
+MAX_DURATION = "max"
+DURATION_STEPS = [12 * 60 * 60, 8 * 60 * 60, 6 * 60 * 60, 4 * 60 * 60, 2 * 60 * 60, 60 * 60, 15 * 60]
+ROLE_CHAINING_MAX_DURATION = 60 * 60  # in seconds
+
+# STS and IAM requests are made with the built-in QueryClient, unless this
+# environment variable is set to "1", or an HTTPS proxy is configured (which
+# QueryClient doesn't support); then boto3 is used instead.
+BOTO3_ENV_VAR = "AWS_JUMPCLOUD_USE_BOTO3"
+PROXY_ENV_VARS = ["HTTPS_PROXY", "https_proxy"]
+
+BOTO3_METHOD_NAMES = {"AssumeRoleWithSAML": "assume_role_with_saml",
+                      "AssumeRole": "assume_role",
+                      "ListAccountAliases": "list_account_aliases"}
+
+IAM_ENDPOINT_URL = "https://iam.amazonaws.com"
+
+# When there's another endpoint to fall back to, don't spend long waiting for
+# one that isn't working.
+FAIL_FAST_TIMEOUT = 5  # in seconds
+
 
 class AWSSession(object):
+    __slots__ = ["access_key_id", "secret_access_key", "session_token", "expires_at"]
+
     def __init__(self, access_key_id, secret_access_key, session_token, expires_at):
         assert(isinstance(access_key_id, str))
         assert(isinstance(secret_access_key, str))
@@ -36,11 +65,11 @@ class AWSSession(object):
     def expired(self):
         return self.expires_at < datetime.now(timezone.utc)
 
-    def dumps(self):
-        return json.dumps({"access_key_id": self.access_key_id,
-                           "secret_access_key": self.secret_access_key,
-                           "session_token": self.session_token,
-                           "expires_at": self.expires_at.timestamp()})
+    def to_dict(self):
+        return {"access_key_id": self.access_key_id,
+                "secret_access_key": self.secret_access_key,
+                "session_token": self.session_token,
+                "expires_at": self.expires_at.timestamp()}
 
     def get_environment_vars(self):
         return {"AWS_ACCESS_KEY_ID": self.access_key_id,
@@ -48,11 +77,17 @@ class AWSSession(object):
                 "AWS_SECURITY_TOKEN": self.session_token,
                 "AWS_SESSION_TOKEN": self.session_token}
 
+    @classmethod
+    def from_dict(cls, data):
+        return AWSSession(access_key_id=data['access_key_id'],
+                          secret_access_key=data['secret_access_key'],
+                          session_token=data['session_token'],
+                          expires_at=datetime.fromtimestamp(data['expires_at'], tz=timezone.utc))
+
     @classmethod
     def loads(cls, json_string):
-        data = json.loads(json_string)
-        data['expires_at'] = datetime.fromtimestamp(data['expires_at'], tz=timezone.utc)
-        return AWSSession(**data)
+        # Reads a session stored as a JSON string, as in keyring schema 1
+        return AWSSession.from_dict(json.loads(json_string))
 
     @classmethod
     def from_sts(cls, sts_resp):
@@ -63,23 +98,22 @@ class AWSSession(object):
                           expires_at=sts_resp['Credentials']['Expiration'])
 
 
-def assume_role_with_saml(saml_role, saml_assertion_xml):
-    client = boto3.client('sts')
-    duration = get_assertion_duration(saml_assertion_xml) or DEFAULT_DURATION
-    sts_resp = client.assume_role_with_saml(
-        RoleArn=saml_role.role_arn,
-        PrincipalArn=saml_role.principal_arn,
-        SAMLAssertion=base64.b64encode(saml_assertion_xml).decode("ascii"),
-        DurationSeconds=duration)
+def assume_role_with_saml(saml_role, saml_assertion_xml, sts_endpoints=(DEFAULT_ENDPOINT,), duration=None):
+    duration = duration or get_assertion_duration(saml_assertion_xml) or DEFAULT_DURATION
+
+    params = {"RoleArn": saml_role.role_arn,
+              "PrincipalArn": saml_role.principal_arn,
+              "SAMLAssertion": base64.b64encode(saml_assertion_xml).decode("ascii"),
+              "DurationSeconds": duration}
+    sts_resp = _call_sts(sts_endpoints, "AssumeRoleWithSAML", params)
     return AWSSession.from_sts(sts_resp)
 
 
 def get_account_alias(session):
     try:
-        client = boto3.client("iam", aws_access_key_id=session.access_key_id,
-                              aws_secret_access_key=session.secret_access_key,
-                              aws_session_token=session.session_token)
-        resp = client.list_account_aliases()
+        (region, url) = _get_default_endpoint("IAM", GLOBAL_ENDPOINT.region, IAM_ENDPOINT_URL)
+        resp = get_scheduler().call(
+            "iam", url, lambda: _call_aws("iam", region, url, "ListAccountAliases", {}, session))
         assert(resp['ResponseMetadata']['HTTPStatusCode'] == 200)
         return resp['AccountAliases'][0] if resp['AccountAliases'] else None
     except Exception:
@@ -99,18 +133,128 @@ def build_arn(aws_account_id, role_name):
     return f"arn:aws:iam::{aws_account_id}:role/{role_name}"
 
 
-def assume_role(session, role_to_assume, role_session_name):
-    client = boto3.client('sts', aws_access_key_id=session.access_key_id,
-                          aws_secret_access_key=session.secret_access_key,
-                          aws_session_token=session.session_token)
+def assume_role(session, role_to_assume, role_session_name, sts_endpoints=(DEFAULT_ENDPOINT,),
+                duration=None):
+    params = {"RoleArn": role_to_assume.arn, "RoleSessionName": role_session_name}
     if role_to_assume.external_id:
-        kwargs = {"ExternalId": role_to_assume.external_id}
-    else:
-        kwargs = {}
-    sts_resp = client.assume_role(RoleArn=role_to_assume.arn,
-                                  RoleSessionName=role_session_name, **kwargs)
+        params["ExternalId"] = role_to_assume.external_id
+    if duration:
+        params["DurationSeconds"] = duration
+    sts_resp = _call_sts(sts_endpoints, "AssumeRole", params, session)
     return AWSSession.from_sts(sts_resp)
 
 
+def get_duration_candidates(duration_setting, known_max_duration=None, limit=None):
+    # Returns the session durations to request, in order. None means the
+    # default: the SAML assertion's SessionDuration for AssumeRoleWithSAML,
+    # and no DurationSeconds at all (i.e. the STS default) for AssumeRole.
+    # Durations longer than `limit` (e.g. ROLE_CHAINING_MAX_DURATION) are
+    # shortened to it.
+    if duration_setting is None:
+        return [None]
+    elif duration_setting == MAX_DURATION:
+        durations = [d for d in DURATION_STEPS if known_max_duration is None or d <= known_max_duration]
+    else:
+        durations = [duration_setting]
+    if limit:
+        durations = sorted(set([min(d, limit) for d in durations]), reverse=True)
+    return durations
+
+
+def assume_with_longest_duration(assume, durations):
+    # Calls assume(duration) with each of the given durations until STS
+    # accepts one. Returns the resulting session and the duration used.
+    for (i, duration) in enumerate(durations):
+        try:
+            return (assume(duration), duration)
+        except AWSRequestError as e:
+            if i == len(durations) - 1 or not _is_duration_too_long(e):
+                raise
+
+
+def is_assertion_rejected(error):
+    # Returns True if STS refused a SAML assertion because it has expired or
+    # is otherwise no longer valid, so that a fresh one might be accepted.
+    if not isinstance(error, AWSRequestError):
+        return False
+    return error.code in ["ExpiredTokenException", "InvalidIdentityToken"]
+
+
+def _is_duration_too_long(error):
+    return error.code == "ValidationError" and "DurationSeconds" in (error.message or "")
+
+
+def _call_sts(sts_endpoints, action, params, session=None):
+    # Makes an STS API call through the first endpoint that works, at the
+    # rate the scheduler allows. Throttling errors are retried by the
+    # scheduler; other errors returned by STS itself are raised immediately;
+    # only connection errors move on to the next endpoint.
+    for (i, endpoint) in enumerate(sts_endpoints):
+        has_fallback = i < len(sts_endpoints) - 1
+        if endpoint.url:
+            (region, url) = endpoint
+        else:
+            (region, url) = _get_default_endpoint("STS", GLOBAL_ENDPOINT.region, GLOBAL_ENDPOINT.url)
+        try:
+            return get_scheduler().call(
+                "sts", url, lambda: _call_aws("sts", region, url, action, params, session, has_fallback))
+        except AWSConnectionError:
+            if not has_fallback:
+                raise
+            report_failure(endpoint)
+
+
+def _get_default_endpoint(service_id, default_region, default_url):
+    # Honors the same environment variables as boto3 for overriding the
+    # endpoint URL (e.g. AWS_ENDPOINT_URL_STS)
+    url = os.environ.get(f"AWS_ENDPOINT_URL_{service_id}") or os.environ.get("AWS_ENDPOINT_URL")
+    if url:
+        return (os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION") or default_region, url)
+    return (default_region, default_url)
+
+
+def _call_aws(service, region, url, action, params, session=None, fail_fast=False):
+    # Returns the response in the same form as boto3 does
+    if os.environ.get(BOTO3_ENV_VAR) == "1" or any([os.environ.get(v) for v in PROXY_ENV_VARS]):
+        return _call_aws_with_boto3(service, region, url, action, params, session, fail_fast)
+    timeout = FAIL_FAST_TIMEOUT if fail_fast else DEFAULT_TIMEOUT
+    result = QueryClient(service, region, url, session, timeout).call(action, params)
+    resp = {"ResponseMetadata": {"HTTPStatusCode": 200}}
+    if action == "ListAccountAliases":
+        resp["AccountAliases"] = [m.text for m in result.findall("AccountAliases/member")]
+    else:
+        resp["Credentials"] = {"AccessKeyId": result.findtext("Credentials/AccessKeyId"),
+                               "SecretAccessKey": result.findtext("Credentials/SecretAccessKey"),
+                               "SessionToken": result.findtext("Credentials/SessionToken"),
+                               "Expiration": parse_timestamp(result.findtext("Credentials/Expiration"))}
+    return resp
+
+
+def _call_aws_with_boto3(service, region, url, action, params, session=None, fail_fast=False):
+    # boto3 is imported here, rather than at the top of this module, so that
+    # the usual code path doesn't pay for importing it
+    import boto3
+    from botocore.config import Config
+    from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+
+    kwargs = {"region_name": region, "endpoint_url": url}
+    if fail_fast:
+        kwargs["config"] = Config(connect_timeout=FAIL_FAST_TIMEOUT, retries={"total_max_attempts": 1})
+    if session:
+        kwargs.update(aws_access_key_id=session.access_key_id,
+                      aws_secret_access_key=session.secret_access_key,
+                      aws_session_token=session.session_token)
+    client = boto3.client(service, **kwargs)
+    method = getattr(client, BOTO3_METHOD_NAMES[action])
+    try:
+        return method(**params)
+    except ClientError as e:
+        error = e.response.get("Error", {})
+        raise AWSRequestError(error.get("Code"), error.get("Message"),
+                              e.response.get("ResponseMetadata", {}).get("HTTPStatusCode")) from e
+    except (BotoConnectionError, HTTPClientError) as e:
+        raise AWSConnectionError(str(e)) from e
+
+
 def get_role_session_name(user_identifier):
     return "-".join(["aws-jumpcloud", user_identifier, str(int(time.time()))])
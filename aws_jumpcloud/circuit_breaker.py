@@ -0,0 +1,79 @@
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import json
+import time
+
+from aws_jumpcloud.lock import FileLock
+import aws_jumpcloud.metrics as metrics
+from aws_jumpcloud.state import get_state_path, write_atomically
+
+# Counts consecutive failures to reach each upstream service ("jumpcloud" or
+# "sts"), across every aws-jumpcloud process, in a file in the state
+# directory. After FAILURE_THRESHOLD failures in a row the circuit opens: for
+# the next COOL_DOWN seconds, logins that need the service fail straight away
+# (or fall back to a session that's still valid) instead of each waiting on
+# timeouts. After that, logins are attempted again; the first success closes
+# the circuit, and another failure opens it again.
+STATE_FILENAME = "circuit-breaker.json"
+LOCK_NAME = "circuit-breaker"
+FAILURE_THRESHOLD = 3
+COOL_DOWN = 60  # in seconds
+
+SERVICE_NAMES = {"jumpcloud": "JumpCloud", "sts": "AWS STS"}
+
+
+def get_open_until(service):
+    """Returns when the service's circuit closes again (a timezone-aware
+    datetime) if it's open, or None if it's closed."""
+    state = _read_state().get(service, {})
+    if state.get("open_until", 0) > time.time():
+        return datetime.fromtimestamp(state["open_until"], tz=timezone.utc)
+    return None
+
+
+def get_failures(service):
+    return _read_state().get(service, {}).get("failures", 0)
+
+
+def record_failure(service):
+    with FileLock(LOCK_NAME):
+        data = _read_state()
+        state = data.setdefault(service, {"failures": 0, "open_until": 0})
+        state["failures"] += 1
+        if state["failures"] >= FAILURE_THRESHOLD:
+            state["open_until"] = time.time() + COOL_DOWN
+            metrics.record(f"{service}_circuit_open", ok=False)
+        write_atomically(get_state_path(STATE_FILENAME), json.dumps(data, sort_keys=True))
+
+
+def record_success(service):
+    # Most logins succeed with the circuit closed, so only take the lock and
+    # write the file if there are failures to forget
+    if service not in _read_state():
+        return
+    with FileLock(LOCK_NAME):
+        data = _read_state()
+        if data.pop(service, None) is not None:
+            write_atomically(get_state_path(STATE_FILENAME), json.dumps(data, sort_keys=True))
+
+
+@contextmanager
+def watch(service, is_outage):
+    """Records the result of the calls to the service made inside the `with`
+    block: a failure if it raises an exception for which is_outage(e) is true,
+    or a success if it doesn't raise at all."""
+    try:
+        yield
+    except Exception as e:
+        if is_outage(e):
+            record_failure(service)
+        raise
+    record_success(service)
+
+
+def _read_state():
+    try:
+        with open(get_state_path(STATE_FILENAME), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
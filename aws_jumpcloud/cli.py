@@ -1,15 +1,19 @@
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
 import sys
 
-from aws_jumpcloud import commands
+import aws_jumpcloud.fanout as fanout
+import aws_jumpcloud.fastpath as fastpath
+import aws_jumpcloud.metrics as metrics
 from aws_jumpcloud.version import __VERSION__
 
 DESCRIPTION = "A vault for securely storing and accessing AWS credentials in development environments."
 
+# The options of "exec" that take a separate value (e.g. "--jobs 16")
+EXEC_OPTIONS_WITH_VALUES = ["--profiles", "-j", "--jobs", "--output", "--max-staleness"]
+
 
 def main():
-    parser = _build_parser()
-    args = parser.parse_args()
+    (parser, args) = _parse_args(sys.argv[1:])
     if 'func' not in args:
         parser.print_usage()
         print("error: the following arguments are required: command")
@@ -20,19 +24,51 @@ def main():
         print("")
 
 
-def _build_parser():
+def _parse_args(argv):
+    multiple_profiles = _is_multiple_profile_exec(argv)
+    parser = _build_parser(multiple_profiles=multiple_profiles)
+    args = parser.parse_args(argv)
+    # After the profile name, --all and --profiles can only have been meant
+    # for the command (e.g. "exec duff docker ps --all"), so don't take them
+    # as a request to run it for many profiles
+    if args.subcommand == "exec" and not multiple_profiles and (args.all or args.profiles):
+        parser.error(f"unrecognized arguments: {'--all' if args.all else '--profiles'} (use \"--\" "
+                     "before the command if it's one of its arguments)")
+    return (parser, args)
+
+
+def _is_multiple_profile_exec(argv):
+    # "exec --profiles" and "exec --all" don't take a profile name, so the
+    # first word of the command mustn't be parsed as one. Only the options
+    # before the profile name or command (i.e. before the first word that
+    # isn't an option, or "--") count.
+    if argv[:1] != ["exec"]:
+        return False
+    i = 1
+    while i < len(argv) and argv[i] != "--" and argv[i].startswith("-"):
+        if argv[i] == "--all" or argv[i] == "--profiles" or argv[i].startswith("--profiles="):
+            return True
+        i += 2 if argv[i] in EXEC_OPTIONS_WITH_VALUES else 1
+    return False
+
+
+def _build_parser(multiple_profiles=False):
     parser = ArgumentParser(description=DESCRIPTION)
     parser.add_argument("--version", action='version', version="%(prog)s ("+__VERSION__+")")
-    subparsers = parser.add_subparsers(dest="command")
+    subparsers = parser.add_subparsers(dest="subcommand")
     _add_help_command(subparsers)
     _add_info_command(subparsers)
     _add_list_command(subparsers)
     _add_add_command(subparsers)
     _add_remove_command(subparsers)
-    _add_exec_command(subparsers)
+    _add_exec_command(subparsers, multiple_profiles)
     _add_export_command(subparsers)
     _add_rotate_command(subparsers)
     _add_is_active_command(subparsers)
+    _add_sync_credentials_command(subparsers)
+    _add_eks_token_command(subparsers)
+    _add_stats_command(subparsers)
+    _add_mfa_seed_command(subparsers)
     return parser
 
 
@@ -43,12 +79,12 @@ def _add_help_command(p):
 
 def _add_info_command(p):
     parser_info = p.add_parser("info", help="display info about your JumpCloud account")
-    parser_info.set_defaults(func=commands.get_info)
+    parser_info.set_defaults(func=_command("get_info"))
 
 
 def _add_list_command(p):
     parser_list = p.add_parser("list", help="list profiles and their sessions")
-    parser_list.set_defaults(func=commands.list_profiles)
+    parser_list.set_defaults(func=_command("list_profiles"))
 
 
 def _add_add_command(p):
@@ -59,7 +95,16 @@ def _add_add_command(p):
                             dest="role_to_assume", metavar="ROLE")
     parser_add.add_argument("--external-id", help="External ID to provide when assuming a role after login",
                             metavar="ID")
-    parser_add.set_defaults(func=commands.add_profile)
+    parser_add.add_argument("--sts-region", metavar="REGION",
+                            help="AWS region whose STS endpoint is used to login, or \"auto\" to use the "
+                                 "fastest one (default: $AWS_JUMPCLOUD_STS_REGION, or the global endpoint)")
+    parser_add.add_argument("--duration", metavar="DURATION",
+                            help="length of each temporary IAM session (e.g. \"3600\", \"90m\" or "
+                                 "\"12h\"), or \"max\" for the longest the role allows")
+    parser_add.add_argument("--identity", metavar="NAME",
+                            help="JumpCloud identity (user account) to log in as, if you have more "
+                                 "than one (default: \"default\")")
+    parser_add.set_defaults(func=_command("add_profile"))
 
 
 def _add_remove_command(p):
@@ -69,29 +114,52 @@ def _add_remove_command(p):
     parser_remove_mx.add_argument(
         "--all", action="store_true",
         help="revoke all temporary IAM sessions and deletes stored JumpCloud authentication information.")
-    parser_remove.set_defaults(func=commands.remove_profile)
+    parser_remove_mx.add_argument("--identity", metavar="NAME",
+                                  help="remove the stored login details for a JumpCloud identity")
+    parser_remove.set_defaults(func=_command("remove_profile"))
 
 
-def _add_exec_command(p):
+def _add_exec_command(p, multiple_profiles=False):
+    # Abbreviations are turned off, so that (say) "--al" can't run a command
+    # for every profile without being recognized as --all beforehand
     parser_exec = p.add_parser(
-        "exec", help="executes a command with AWS credentials in the environment")
-    parser_exec.add_argument("profile", help="name of the profile")
+        "exec", help="executes a command with AWS credentials in the environment", allow_abbrev=False)
+    if multiple_profiles:
+        parser_exec.set_defaults(profile=None)
+    else:
+        parser_exec.add_argument("profile", help="name of the profile")
     parser_exec.add_argument("command", nargs="+")
-    parser_exec.set_defaults(func=commands.exec_command)
+    parser_exec.add_argument("--profiles", metavar="PROFILE,...",
+                             help="run the command for each of these comma-separated profiles, in parallel")
+    parser_exec.add_argument("--all", action="store_true",
+                             help="run the command for every profile, in parallel")
+    parser_exec.add_argument("--rotate", action="store_true",
+                             help="serve credentials to the command from a local endpoint that refreshes "
+                                  "them before they expire, for commands that run longer than a session")
+    parser_exec.add_argument("-j", "--jobs", type=_positive_int, default=8,
+                             help="with --profiles or --all, how many commands to run at once (default: 8)")
+    parser_exec.add_argument("--output", choices=[fanout.OUTPUT_PREFIX, fanout.OUTPUT_COLLECT],
+                             default=fanout.OUTPUT_PREFIX,
+                             help="with --profiles or --all, whether to prefix each line of output with "
+                                  "the profile name as it arrives, or to print each command's output "
+                                  "together when it finishes (default: prefix)")
+    _add_max_staleness_argument(parser_exec)
+    parser_exec.set_defaults(func=_command("exec_command", fast=fastpath.exec_command))
 
 
 def _add_is_active_command(p):
     parser_export = p.add_parser(
         "is-active", help="returns 1 if a session is active for this profile")
     parser_export.add_argument("profile", help="name of the profile")
-    parser_export.set_defaults(func=commands.is_active)
+    parser_export.set_defaults(func=fastpath.is_active)
 
 
 def _add_export_command(p):
     parser_export = p.add_parser(
         "export", help="show export statements to load AWS credentials into your environment")
     parser_export.add_argument("profile", help="name of the profile")
-    parser_export.set_defaults(func=commands.export_vars)
+    _add_max_staleness_argument(parser_export)
+    parser_export.set_defaults(func=_command("export_vars", fast=fastpath.export_vars))
 
 
 def _add_rotate_command(p):
@@ -103,7 +171,87 @@ def _add_rotate_command(p):
     parser_rotate_mx.add_argument(
         "--all", action="store_true",
         help="generate new temporary IAM credentials for all existing profiles")
-    parser_rotate.set_defaults(func=commands.rotate_session)
+    parser_rotate.add_argument("-j", "--jobs", type=_positive_int, default=8,
+                               help="with --all, how many profiles to rotate at once (default: 8)")
+    parser_rotate.set_defaults(func=_command("rotate_session"))
+
+
+def _add_sync_credentials_command(p):
+    parser_sync = p.add_parser(
+        "sync-credentials",
+        help="write temporary IAM credentials into a shared AWS credentials file (~/.aws/credentials)")
+    parser_sync_mx = parser_sync.add_mutually_exclusive_group(required=True)
+    parser_sync_mx.add_argument("profiles", help="names of the profiles", nargs="*", default=[])
+    parser_sync_mx.add_argument("--all", action="store_true", help="write credentials for all profiles")
+    parser_sync.add_argument(
+        "--file", help="credentials file to write (default: ~/.aws/credentials, or "
+                       "$AWS_SHARED_CREDENTIALS_FILE if set)")
+    parser_sync.add_argument(
+        "--watch", action="store_true",
+        help="keep running, and rewrite the file whenever sessions are rotated or expire")
+    parser_sync.add_argument("--interval", type=int, default=30, metavar="SECONDS",
+                             help="how often to check for new sessions with --watch (default: 30)")
+    parser_sync.set_defaults(func=_command("sync_credentials"))
+
+
+def _add_eks_token_command(p):
+    parser_eks = p.add_parser(
+        "eks-token", help="print an EKS authentication token (for use as a kubectl exec plugin)")
+    parser_eks.add_argument("profile", help="name of the profile")
+    parser_eks.add_argument("--cluster", required=True, help="name of the EKS cluster")
+    parser_eks.add_argument("--region", help="AWS region of the EKS cluster (default: $AWS_REGION, "
+                            "$AWS_DEFAULT_REGION or us-east-1)")
+    parser_eks.set_defaults(func=fastpath.eks_token)
+
+
+def _add_mfa_seed_command(p):
+    parser_mfa_seed = p.add_parser(
+        "mfa-seed",
+        help="store or remove the TOTP seed used to generate JumpCloud MFA codes without prompting")
+    parser_mfa_seed.add_argument("action", choices=["set", "remove"])
+    parser_mfa_seed.add_argument("--identity", metavar="NAME",
+                                 help="JumpCloud identity whose seed to store or remove "
+                                      "(default: \"default\")")
+    parser_mfa_seed.set_defaults(func=_command("mfa_seed"))
+
+
+def _add_stats_command(p):
+    parser_stats = p.add_parser("stats", help="show how long logins and other operations have been taking")
+    parser_stats.add_argument("--days", type=int, metavar="N", help="only include the last N days")
+    parser_stats.add_argument("--profile", help="only include records for this profile")
+    parser_stats.set_defaults(func=_command("show_stats"))
+
+
+def _add_max_staleness_argument(parser):
+    parser.add_argument("--max-staleness", metavar="DURATION",
+                        help="how long after a session is due for renewal (15 minutes before it "
+                             "expires) it may still be used while it's renewed in the background, e.g. "
+                             "\"0\" or \"5m\" (default: $AWS_JUMPCLOUD_MAX_STALENESS, or 10m)")
+
+
+def _positive_int(value):
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise ArgumentTypeError(f"must be a positive whole number, not \"{value}\"")
+    return number
+
+
+def _command(name, fast=None):
+    # Defers importing aws_jumpcloud.commands (and with it boto3 and the OS
+    # keyring libraries) until a command that needs it actually runs. If a
+    # fast implementation is given, it runs first, and the command only runs
+    # if that returns False.
+    def run(args):
+        metrics.set_command(args.subcommand)
+        with metrics.timed(f"command:{args.subcommand}"):
+            if fast is not None and fast(args) is not False:
+                return
+            from aws_jumpcloud import commands
+            return getattr(commands, name)(args)
+    return run
 
 
 def _print_help(args):
@@ -1,34 +1,106 @@
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 import getpass
+import json
 import os
+import re
 import sys
 import subprocess
 import textwrap
+import threading
+import time
 from subprocess import PIPE
 
-from aws_jumpcloud.aws import assume_role, assume_role_with_saml
+from requests import RequestException
+
+from aws_jumpcloud.aws import assume_role, assume_role_with_saml, assume_with_longest_duration
+from aws_jumpcloud.aws import get_duration_candidates, MAX_DURATION, ROLE_CHAINING_MAX_DURATION
 from aws_jumpcloud.aws import get_account_alias, get_role_session_name
-from aws_jumpcloud.aws import is_arn, parse_arn
+from aws_jumpcloud.aws import is_arn, is_assertion_rejected, parse_arn
+import aws_jumpcloud.circuit_breaker as circuit_breaker
+import aws_jumpcloud.credentials_file as credentials_file
+from aws_jumpcloud.credentials_server import CredentialsServer
+import aws_jumpcloud.eks as eks
+import aws_jumpcloud.fanout as fanout
+from aws_jumpcloud.identity import DEFAULT_IDENTITY
+import aws_jumpcloud.inherited_session as inherited_session
+import aws_jumpcloud.metrics as metrics
 from aws_jumpcloud.jumpcloud import JumpCloudSession, JumpCloudError, JumpCloudAuthFailure
-from aws_jumpcloud.jumpcloud import JumpCloudMFARequired, JumpCloudServerError
-from aws_jumpcloud.jumpcloud import JumpCloudUnexpectedStatus, JumpCloudMissingSAMLResponse
+from aws_jumpcloud.jumpcloud import JumpCloudMFAFailure, JumpCloudMFARequired, JumpCloudServerError
+from aws_jumpcloud.jumpcloud import JumpCloudUnexpectedStatus, JumpCloudMissingSAMLResponse, PROMPT_LOCK
 from aws_jumpcloud.keyring import Keyring
+from aws_jumpcloud.lock import FileLock
 from aws_jumpcloud.profile import AssumedRole, Profile
+from aws_jumpcloud.query_client import AWSConnectionError, AWSRequestError
+import aws_jumpcloud.revalidate as revalidate
 from aws_jumpcloud.saml import get_assertion_roles
+import aws_jumpcloud.saml_cache as saml_cache
+from aws_jumpcloud.scheduler import get_scheduler, is_server_error
+from aws_jumpcloud.sts_endpoints import get_sts_endpoints
 import aws_jumpcloud.onepassword as op
+import aws_jumpcloud.totp as totp
+
+# Logged-in JumpCloudSessions, by identity, shared by every thread in this
+# process. Each identity logs in once, and again only if its session is older
+# than JUMPCLOUD_SESSION_MAX_AGE, or JumpCloud stops accepting it, which
+# matters in processes that run for hours (exec --rotate, or the Python API).
+_sessions = {}
+JUMPCLOUD_SESSION_MAX_AGE = 30 * 60  # in seconds
+_sessions_lock = threading.Lock()
+_identity_locks = {}
 
-_session = None
+# Logins in threads that set _non_interactive.active never prompt, as if
+# stdout weren't a terminal; see _can_prompt()
+_non_interactive = threading.local()
+
+# Sets the session duration for profiles that don't have their own, in the
+# same format as "aws-jumpcloud add --duration".
+DURATION_ENV_VAR = "AWS_JUMPCLOUD_SESSION_DURATION"
+DURATION_REGEXP = re.compile(r"^([0-9]+)([smh]?)$")
 
 
 def get_info(args):
     keyring = Keyring()
-    print("")
-    email = keyring.get_jumpcloud_email()
-    password = keyring.get_jumpcloud_password()
-    ts = keyring.get_jumpcloud_timestamp()
-    print(f"JumpCloud email: {email or '<not stored>'}")
-    print(f"JumpCloud password: {'******** (hidden)' if password else '<not stored>'}")
-    print(f"Last JumpCloud authentication: {ts.astimezone().strftime('%c %Z') if ts else '<never>'}")
+    other_identities = sorted([name for name in keyring.get_all_identities() if name != DEFAULT_IDENTITY])
+    for identity in [DEFAULT_IDENTITY] + other_identities:
+        print("")
+        if other_identities:
+            print(f"JumpCloud identity: {identity}")
+        email = keyring.get_jumpcloud_email(identity)
+        password = keyring.get_jumpcloud_password(identity)
+        ts = keyring.get_jumpcloud_timestamp(identity)
+        print(f"JumpCloud email: {email or '<not stored>'}")
+        print(f"JumpCloud password: {'******** (hidden)' if password else '<not stored>'}")
+        print(f"Last JumpCloud authentication: {ts.astimezone().strftime('%c %Z') if ts else '<never>'}")
+        seed = keyring.get_jumpcloud_mfa_seed(identity)
+        print(f"JumpCloud MFA seed: {'******** (hidden)' if seed else '<not stored>'}")
+
+
+def mfa_seed(args):
+    keyring = Keyring()
+    identity = args.identity or DEFAULT_IDENTITY
+    if args.action == "remove":
+        keyring.store_jumpcloud_mfa_seed(None, identity=identity)
+        print("JumpCloud MFA seed removed from your OS keychain.")
+        return
+
+    # The seed is read like a password, so that it isn't echoed or left in
+    # the shell history, or from stdin when that isn't a terminal
+    if sys.stdin.isatty():
+        value = getpass.getpass("Enter your JumpCloud MFA seed (or otpauth:// URI): ")
+    else:
+        value = sys.stdin.readline()
+    try:
+        seed = totp.parse_seed(value)
+    except ValueError as e:
+        _print_error(f"Error: Invalid MFA seed ({e}).")
+        sys.exit(1)
+    keyring.store_jumpcloud_mfa_seed(seed, identity=identity)
+    code = totp.generate_code(seed, totp.get_counter())
+    print("JumpCloud MFA seed saved in your OS keychain. aws-jumpcloud will generate MFA codes")
+    print(f"from now on, without prompting. The current code is {code}; check that it matches")
+    print("your authenticator app.")
 
 
 def list_profiles(args):
@@ -49,6 +121,7 @@ def add_profile(args):
     if args.external_id and not args.role_to_assume:
         _print_error("Error: Cannot use --external-id without --role.")
         sys.exit(1)
+    session_duration = _parse_duration(args.duration, "--duration") if args.duration else None
 
     keyring = Keyring()
     if keyring.get_profile(args.profile):
@@ -74,9 +147,13 @@ def add_profile(args):
                                        external_id=args.external_id)
     else:
         assumed_role = None
-    profile = Profile(args.profile, jumpcloud_url, assumed_role)
+    profile = Profile(args.profile, jumpcloud_url, assumed_role, sts_region=args.sts_region,
+                      session_duration=session_duration, identity=args.identity)
     keyring.store_profile(profile)
     print(f"Profile \"{args.profile}\" added.")
+    if args.identity and args.identity not in keyring.get_all_identities():
+        print(f"You will be asked for the JumpCloud login details for \"{args.identity}\" the first time "
+              "you use it.")
 
 
 def is_active(args):
@@ -90,15 +167,23 @@ def is_active(args):
 def remove_profile(args):
     if args.all:
         _remove_all_profiles(args)
+    elif args.identity:
+        _remove_identity(args)
     else:
         _remove_single_profile(args)
 
 
 def exec_command(args):
+    if args.all or args.profiles:
+        _exec_for_multiple_profiles(args)
+        return
+    if args.rotate:
+        _exec_with_rotation(args)
+        return
     # Run the command that the user wanted, with AWS credentials in the environment
-    session = _get_aws_session(args.profile)
+    session = _get_aws_session(args.profile, max_staleness=_get_max_staleness(args.max_staleness))
     args.command[0] = _which(args.command[0])
-    for (name, value) in session.get_environment_vars().items():
+    for (name, value) in _get_environment_vars(args.profile, session).items():
         os.environ[name] = value
     result = subprocess.run(args.command)
     sys.exit(result.returncode)
@@ -106,11 +191,22 @@ def exec_command(args):
 
 def export_vars(args):
     # Print export statements for a profile's AWS credentials
-    session = _get_aws_session(args.profile)
-    for (name, value) in session.get_environment_vars().items():
+    session = _get_aws_session(args.profile, max_staleness=_get_max_staleness(args.max_staleness))
+    for (name, value) in _get_environment_vars(args.profile, session).items():
         print(f"export {name}=\"{value}\"")
 
 
+def eks_token(args):
+    # Print a Kubernetes ExecCredential for an EKS cluster, for use as a
+    # kubectl exec plugin. The token is signed locally and cached until
+    # shortly before it expires.
+    session = _get_aws_session(args.profile)
+    region = eks.get_region(args.region)
+    credential = eks.build_exec_credential(session, args.cluster, region)
+    eks.write_cached_credential(args.profile, args.cluster, region, credential)
+    print(json.dumps(credential))
+
+
 def rotate_session(args):
     if args.all:
         _rotate_all_sessions(args)
@@ -118,6 +214,55 @@ def rotate_session(args):
         _rotate_single_session(args)
 
 
+def show_stats(args):
+    # Summarize the timing records that previous commands left behind
+    since = time.time() - args.days * 24 * 60 * 60 if args.days else None
+    records = [r for r in metrics.read_records(since)
+               if not args.profile or metrics.is_for_profile(r, args.profile)]
+    if len(records) == 0:
+        print("")
+        print("No timing records found. They are recorded as you use aws-jumpcloud.")
+        sys.exit(0)
+
+    oldest = time.strftime('%c', time.localtime(records[0]["ts"]))
+    print("")
+    print(f"Based on {len(records)} records since {oldest}.")
+    print("")
+    _print_columns(headers=["Phase", "Count", "Failed", "p50 (ms)", "p95 (ms)", "p99 (ms)"],
+                   rows=_format_stats_rows(records, lambda r: [r["phase"]]))
+    profile_rows = _format_stats_rows([r for r in records if r.get("profile") is not None],
+                                      lambda r: [r["profile"], r["phase"]])
+    if profile_rows:
+        print("")
+        _print_columns(headers=["Profile", "Phase", "Count", "Failed", "p50 (ms)", "p95 (ms)", "p99 (ms)"],
+                       rows=profile_rows)
+
+    hits = len([r for r in records if r["phase"] == "session_cache_hit"])
+    misses = len([r for r in records if r["phase"] == "session_cache_miss"])
+    logins = [r for r in records if r["phase"] == "jumpcloud_login"]
+    mfa_prompts = len([r for r in records if r["phase"] == "mfa_prompt"])
+    print("")
+    if hits + misses > 0:
+        ratio = 100 * hits / (hits + misses)
+        print(f"Session cache hit ratio: {ratio:.0f}% ({hits} hits, {misses} misses)")
+    print(f"JumpCloud logins: {len(logins)} ({len([r for r in logins if not r['ok']])} failed)")
+    print(f"MFA prompts: {mfa_prompts}")
+
+
+def sync_credentials(args):
+    # Write the cached AWS sessions for one or more profiles into a shared
+    # credentials file, for tools that don't read environment variables
+    path = os.path.expanduser(args.file) if args.file else credentials_file.get_default_path()
+    profile_names = _get_sync_profile_names(args)
+    fingerprint = _sync_credentials_file(path, profile_names)
+    if not args.watch:
+        return
+    sys.stderr.write(f"Watching for new sessions every {args.interval} seconds; press Ctrl-C to stop.\n")
+    while True:
+        time.sleep(args.interval)
+        fingerprint = _sync_credentials_file(path, profile_names, fingerprint)
+
+
 def _remove_single_profile(args):
     keyring = Keyring()
     if not keyring.get_profile(args.profile):
@@ -126,6 +271,7 @@ def _remove_single_profile(args):
     has_session = not not keyring.get_session(args.profile)
     keyring.delete_session(args.profile)
     keyring.delete_profile(args.profile)
+    eks.delete_cached_credentials(args.profile)
     if has_session:
         print(f"Profile \"{args.profile}\" and temporary IAM session removed.")
     else:
@@ -135,11 +281,25 @@ def _remove_single_profile(args):
 def _remove_all_profiles(args):
     keyring = Keyring()
     keyring.delete_all_data()
+    eks.delete_cached_credentials()
     print("")
     print("All configuration profiles, temporary IAM sessions, and JumpCloud login")
     print("credentials have been removed from your OS keychain.")
 
 
+def _remove_identity(args):
+    keyring = Keyring()
+    if args.identity not in keyring.get_all_identities():
+        print(f"JumpCloud identity \"{args.identity}\" not found, nothing to do.")
+        return
+    keyring.delete_identity(args.identity)
+    print(f"JumpCloud login details for \"{args.identity}\" removed.")
+    profile_names = sorted([p.name for p in keyring.get_all_profiles().values()
+                            if p.identity_name == args.identity])
+    if profile_names:
+        print(f"Profiles that use it (you will be asked for new login details): {', '.join(profile_names)}")
+
+
 def _rotate_single_session(args, profile_name=None):
     if not profile_name:
         profile_name = args.profile
@@ -151,15 +311,19 @@ def _rotate_single_session(args, profile_name=None):
         sys.stderr.write(f"Error: Profile \"{profile_name}\" not found.\n")
         sys.exit(1)
 
-    _login_to_jumpcloud(profile_name)
+    # Log in before removing the old session, so that a failed login leaves it
+    # in place. A cached SAML assertion doesn't need a login at all.
+    _login_to_identities(_get_identities_to_log_in(keyring, [profile_name]), profile_name)
 
-    keyring.delete_session(profile_name)
-    print(f"Temporary IAM session for \"{profile_name}\" removed.")
+    with _login_lock(profile_name):
+        keyring.delete_session(profile_name)
+        print(f"Temporary IAM session for \"{profile_name}\" removed.")
 
-    _login_to_aws(keyring, profile)
-    session = keyring.get_session(profile_name)
+        with metrics.timed("aws_login", profile_name):
+            _login_to_aws(keyring, profile)
+        session = keyring.get_session(profile_name)
     expires_at = session.expires_at.strftime('%c %Z')
-    print(f"AWS temporary session rotated; new session valid until {expires_at}.\n")
+    print(f"AWS temporary session for \"{profile_name}\" rotated; new session valid until {expires_at}.\n")
 
 
 def _rotate_all_sessions(args):
@@ -170,119 +334,501 @@ def _rotate_all_sessions(args):
         print("No profiles found. Use \"aws-jumpcloud add <profile>\" to store a new profile.")
         sys.exit(0)
 
-    _login_to_jumpcloud('--all')
+    _login_to_identities(_get_identities_to_log_in(keyring, profiles.keys()), '--all')
     print("")
 
-    for profile in profiles.values():
-        _rotate_single_session(args, profile.name)
+    # Rotate several profiles at once; the scheduler keeps the STS and IAM
+    # requests within AWS's rate limits.
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        list(executor.map(lambda name: _rotate_single_session(args, name), sorted(profiles.keys())))
+    _print_scheduler_summary()
+
+
+def _exec_with_rotation(args):
+    # Run the command with a local endpoint that serves the profile's AWS
+    # credentials, and keeps replacing them before they expire, instead of
+    # credentials in its environment
+    session = _get_aws_session(args.profile)
+    command = [_which(args.command[0])] + args.command[1:]
+
+    def refresh(current):
+        # Any session that outlives the current one will do, e.g. one that
+        # another process has already stored in the keychain. The command is
+        # using the terminal by now, so this never prompts (just like a
+        # background revalidation); if logging in would need to, it fails,
+        # and the server keeps serving the current session.
+        min_lifetime = current.expires_at - datetime.now(timezone.utc) + timedelta(seconds=1)
+        _non_interactive.active = True
+        return _get_aws_session(args.profile, min_lifetime=min_lifetime)
+    server = CredentialsServer(session, refresh)
+    server.start()
+
+    # Credentials in the environment, or a profile from ~/.aws/config, would
+    # take precedence over the endpoint
+    env = dict(os.environ)
+    for name in inherited_session.CREDENTIAL_ENV_VARS + ["AWS_PROFILE", "AWS_DEFAULT_PROFILE"]:
+        env.pop(name, None)
+    env.update(server.get_environment_vars())
+    result = subprocess.run(command, env=env)
+    server.stop()
+    sys.exit(result.returncode)
+
+
+def _exec_for_multiple_profiles(args):
+    # Run the command once per profile, several at a time, with each
+    # profile's AWS credentials in its environment
+    start = time.monotonic()
+    if args.all and args.profiles:
+        _print_error("Error: Cannot use --profiles with --all.")
+        sys.exit(2)
+    if args.rotate:
+        _print_error("Error: Cannot use --rotate with --profiles or --all.")
+        sys.exit(2)
+
+    keyring = Keyring()
+    if args.all:
+        profile_names = sorted(keyring.get_all_profiles().keys())
+        if len(profile_names) == 0:
+            print("")
+            print("No profiles found. Use \"aws-jumpcloud add <profile>\" to store a new profile.")
+            sys.exit(0)
+    else:
+        profile_names = [name.strip() for name in args.profiles.split(",") if name.strip()]
+        if len(profile_names) == 0:
+            _print_error("Error: --profiles needs at least one profile name.")
+            sys.exit(2)
+
+    # Log in to any profiles that don't have a session yet before running
+    # anything.
+    sessions = _get_aws_sessions(profile_names, args.jobs, _get_max_staleness(args.max_staleness))
+    command = [_which(args.command[0])] + args.command[1:]
+    environments = [(name, dict(os.environ, **_get_environment_vars(name, sessions[name])))
+                    for name in profile_names]
+    results = fanout.run_all(command, environments, args.jobs, args.output)
+
+    failures = [r for r in results if r.returncode != 0]
+    sys.stderr.write("\n")
+    _print_columns(headers=["Profile", "Exit code", "Time"],
+                   rows=[[r.name, str(r.returncode), f"{r.duration:.1f}s"] for r in results],
+                   file=sys.stderr)
+    sys.stderr.write(f"\nRan on {len(results)} profile(s) in {time.monotonic() - start:.1f}s; "
+                     f"{len(failures)} failed.\n")
+    sys.exit(max([_get_exit_status(r.returncode) for r in failures], default=0))
+
+
+def _get_exit_status(returncode):
+    # A command killed by a signal has a negative returncode; exit the way a
+    # shell reports it instead, i.e. with 128 plus the signal number
+    return 128 - returncode if returncode < 0 else returncode
+
+
+def _format_stats_rows(records, group_key):
+    groups = {}
+    for r in records:
+        if "ms" in r:
+            groups.setdefault(tuple(group_key(r)), []).append(r)
+    rows = []
+    for key in sorted(groups.keys()):
+        durations = [r["ms"] for r in groups[key]]
+        failed = len([r for r in groups[key] if not r["ok"]])
+        rows.append(list(key) + [str(len(durations)), str(failed)] +
+                    [f"{metrics.percentile(durations, p):.0f}" for p in [50, 95, 99]])
+    return rows
 
 
-def _get_aws_session(profile_name):
+def _get_sync_profile_names(args):
+    keyring = Keyring()
+    profiles = keyring.get_all_profiles()
+    if args.all:
+        if len(profiles) == 0:
+            print("")
+            print("No profiles found. Use \"aws-jumpcloud add <profile>\" to store a new profile.")
+            sys.exit(0)
+        return sorted(profiles.keys())
+    for profile_name in args.profiles:
+        if profile_name not in profiles:
+            _print_error(f"Error: Profile \"{profile_name}\" not found; you must add it first.")
+            sys.exit(1)
+    return args.profiles
+
+
+def _sync_credentials_file(path, profile_names, previous_fingerprint=None):
+    # Writes every valid session for the given profiles into the credentials
+    # file in a single atomic write, and removes the sections for profiles
+    # whose sessions have expired. Returns a fingerprint of the sessions that
+    # were written, so callers can skip rewriting the file when nothing changed.
+    all_sessions = Keyring().get_all_sessions()
+    sessions = dict([(name, all_sessions[name]) for name in profile_names if name in all_sessions])
+    fingerprint = sorted([(name, s.access_key_id, s.expires_at) for (name, s) in sessions.items()])
+    if fingerprint == previous_fingerprint:
+        return fingerprint
+    expired = [name for name in profile_names if name not in sessions]
+    if credentials_file.write_sessions(path, sessions, remove=expired):
+        sys.stderr.write(f"Wrote temporary credentials for {len(sessions)} of {len(profile_names)} "
+                         f"profile(s) to {path}.\n")
+    return fingerprint
+
+
+def _get_aws_session(profile_name, min_lifetime=None, max_staleness=None, stale_profiles=None):
     # Validates the profile parameter and returns the profile's AWS session,
     # going through the single sign-on process if necessary. This is a wrapper
-    # around _login_to_jumpcloud() and _login_to_aws().
+    # around _login_to_jumpcloud() and _login_to_aws(). If min_lifetime (a
+    # timedelta) is given, a session that expires sooner than that is
+    # replaced too. Otherwise, a stale session is served while it's replaced
+    # in the background, unless it has been stale for longer than
+    # max_staleness (a timedelta; see revalidate.py). Callers that get many
+    # sessions pass a stale_profiles list, which the names of profiles with
+    # stale sessions are added to, and replace them all at once afterwards.
     keyring = Keyring()
     profile = keyring.get_profile(profile_name)
     if not profile:
         _print_error(f"Error: Profile \"{profile_name}\" not found; you must add it first.")
         sys.exit(1)
+    max_staleness = _get_max_staleness() if max_staleness is None else max_staleness
+    session = _get_usable_session(keyring, profile_name, min_lifetime, max_staleness)
+    if session:
+        if not min_lifetime and revalidate.get_staleness(session) > timedelta(0):
+            metrics.record("session_stale_hit", profile_name)
+            if stale_profiles is None:
+                _start_revalidation(keyring, [profile_name])
+            else:
+                stale_profiles.append(profile_name)
+        metrics.record("session_cache_hit", profile_name)
+        return session
+    with _login_lock(profile_name):
+        # Another process may have logged in while we waited for the lock
+        session = _get_usable_session(keyring, profile_name, min_lifetime, max_staleness)
+        if session:
+            metrics.record("session_cache_hit", profile_name)
+            return session
+        metrics.record("session_cache_miss", profile_name)
+        # A session that's too stale (but still valid) is better than none if
+        # logging in fails, e.g. because JumpCloud or STS is down
+        fallback = None if min_lifetime else keyring.get_session(profile_name)
+        try:
+            with metrics.timed("aws_login", profile_name):
+                _login_to_aws(keyring, profile)
+        except (Exception, SystemExit):
+            if fallback is None:
+                raise
+            expires_at = fallback.expires_at.astimezone().strftime('%c %Z')
+            sys.stderr.write(f"Couldn't log in again; using the current AWS session for "
+                             f"\"{profile_name}\", which expires at {expires_at}.\n")
+            metrics.record("session_stale_fallback", profile_name)
+            return fallback
+        return keyring.get_session(profile_name)
+
+
+def _get_usable_session(keyring, profile_name, min_lifetime, max_staleness):
     session = keyring.get_session(profile_name)
     if not session:
-        _login_to_aws(keyring, profile)
-        session = keyring.get_session(profile_name)
-    return session
+        return None
+    now = datetime.now(timezone.utc)
+    if min_lifetime:
+        return session if session.expires_at - min_lifetime >= now else None
+    return session if revalidate.get_staleness(session, now) <= max_staleness else None
+
+
+def _get_max_staleness(value=None):
+    # Parses the --max-staleness option (or the environment variable), like
+    # "300", "5m" or "0", into a timedelta
+    source = "--max-staleness"
+    if value is None:
+        source = revalidate.MAX_STALENESS_ENV_VAR
+        value = os.environ.get(source)
+        if not value:
+            return revalidate.DEFAULT_MAX_STALENESS
+    match = DURATION_REGEXP.match(value.strip())
+    if not match:
+        _print_error(f"Error: Invalid staleness \"{value}\" in {source}. Use a number of seconds, "
+                     "minutes (e.g. \"5m\") or hours.")
+        sys.exit(1)
+    return timedelta(seconds=int(match.group(1)) * {"": 1, "s": 1, "m": 60, "h": 60 * 60}[match.group(2)])
 
 
-def _input_email():
-    return input("Enter your JumpCloud email address: ").strip()
+def _start_revalidation(keyring, profile_names):
+    # Starts replacing the profiles' stale sessions in the background, with
+    # one process per JumpCloud identity, so that each identity logs in once
+    identities = {}
+    for name in profile_names:
+        identities.setdefault(keyring.get_profile(name).identity_name, []).append(name)
+    for identity in sorted(identities.keys()):
+        revalidate.start(sorted(identities[identity]))
 
 
-def _input_password():
-    return getpass.getpass("Enter your JumpCloud password: ").strip()
+def _revalidate_sessions(profile_names):
+    # Runs in the background process that revalidate.start() starts: logs in
+    # again to those of the profiles whose sessions are still stale, sharing
+    # one JumpCloud login, and skipping any that another process is already
+    # logging in to, or whose login is bound to fail.
+    keyring = Keyring()
+    locks = []
+    profiles = []
+    try:
+        for name in profile_names:
+            lock = FileLock(f"login-{name}")
+            if not lock.acquire(blocking=False):
+                continue
+            locks.append(lock)
+            profile = keyring.get_profile(name)
+            session = keyring.get_session(name)
+            if not profile or (session and revalidate.get_staleness(session) <= timedelta(0)):
+                continue
+            if not _get_open_circuit(keyring, profile):
+                profiles.append(profile)
+        if not profiles:
+            return
+        names = [p.name for p in profiles]
+        _login_to_identities(_get_identities_to_log_in(keyring, names), names[0])
+
+        def login(profile):
+            with metrics.timed("aws_login", profile.name):
+                _login_to_aws(Keyring(), profile)
+        with ThreadPoolExecutor(max_workers=revalidate.JOBS) as executor:
+            list(executor.map(login, profiles))
+    finally:
+        for lock in locks:
+            lock.release()
+
+
+def _get_aws_sessions(profile_names, jobs, max_staleness=None):
+    # Returns a dict of profile name to AWS session, logging in to up to
+    # `jobs` profiles at once. The JumpCloud logins (and any prompts) happen
+    # first, once per identity, and are shared by all of them; the scheduler
+    # keeps the STS and IAM requests within AWS's rate limits. Stale sessions
+    # are served, and replaced by one background process per identity.
+    keyring = Keyring()
+    max_staleness = _get_max_staleness() if max_staleness is None else max_staleness
+    names = [name for name in profile_names if not _get_usable_session(keyring, name, None, max_staleness)]
+    _login_to_identities(_get_identities_to_log_in(keyring, names), profile_names[0])
+    stale_profiles = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        sessions = dict(zip(profile_names, executor.map(
+            lambda name: _get_aws_session(name, max_staleness=max_staleness, stale_profiles=stale_profiles),
+            profile_names)))
+    if stale_profiles:
+        _start_revalidation(keyring, stale_profiles)
+    _print_scheduler_summary()
+    return sessions
+
+
+def _get_identities_to_log_in(keyring, profile_names):
+    # Returns the JumpCloud identities that logging in to the profiles needs,
+    # i.e. those of the profiles that don't have a cached SAML assertion, as a
+    # dict of identity to the names of those profiles.
+    identities = {}
+    for name in profile_names:
+        profile = keyring.get_profile(name)
+        if profile and saml_cache.get(keyring, profile) is None:
+            identities.setdefault(profile.identity_name, []).append(name)
+    return identities
+
+
+def _login_to_identities(identities, profile_name):
+    # Logs in to all of the JumpCloud identities at once. Any prompts (for
+    # login details or MFA codes) still happen one at a time.
+    if len(identities) == 1:
+        (identity, profile_names) = list(identities.items())[0]
+        _login_to_jumpcloud(profile_name, identity, profile_names)
+    elif identities:
+        with ThreadPoolExecutor(max_workers=len(identities)) as executor:
+            list(executor.map(lambda item: _login_to_jumpcloud(profile_name, *item), identities.items()))
+
+
+def _get_open_circuit(keyring, profile):
+    # Returns the upstream service that logging in to the profile needs, but
+    # whose circuit breaker is open, or None. JumpCloud isn't needed if
+    # there's a cached SAML assertion.
+    services = ["sts"]
+    if saml_cache.get(keyring, profile) is None:
+        services.insert(0, "jumpcloud")
+    for service in services:
+        if circuit_breaker.get_open_until(service):
+            return service
+    return None
+
+
+def _exit_if_circuit_open(service):
+    open_until = circuit_breaker.get_open_until(service)
+    if open_until:
+        name = circuit_breaker.SERVICE_NAMES[service]
+        _print_error(f"Error: {name} has failed {circuit_breaker.get_failures(service)} times in a row, so "
+                     f"aws-jumpcloud won't try it again until {open_until.astimezone().strftime('%X %Z')}.")
+        sys.exit(1)
 
 
-def _get_email():
-    if op.installed():
-        sys.stderr.write(f"1Password CLI found. Using email from item: {op.ITEM}\n")
-        email = op.get_email()
+def _is_outage(e):
+    # Whether an exception means that JumpCloud or STS isn't working (rather
+    # than, say, a wrong password), for the circuit breaker
+    if isinstance(e, AWSRequestError):
+        return is_server_error(e)
+    return isinstance(e, (RequestException, JumpCloudServerError, AWSConnectionError))
 
-        if email:
-            return email
-        else:
-            sys.stderr.write(f"1Password email not found for item: {op.ITEM}. "
-                              "Falling back to user input.\n")
-            return _input_email()
-    else:
-        return _input_email()
 
+def _print_scheduler_summary():
+    summary = get_scheduler().get_summary()
+    if summary:
+        sys.stderr.write(f"{summary}\n")
 
-def _get_password():
-    if op.installed():
-        sys.stderr.write(f"1Password CLI found. Using password from item: {op.ITEM}\n")
-        passwd = op.get_password()
 
-        if passwd:
-            return passwd
-        else:
-            sys.stderr.write(f"1Password password not found for item: {op.ITEM}. "
-                              "Falling back to user input.\n")
-            return _input_password()
-    else:
-        return _input_password()
+def _get_environment_vars(profile_name, session):
+    # The session's credentials, plus the variables that let a nested exec or
+    # export for the same profile reuse them
+    return dict(session.get_environment_vars(), **inherited_session.get_marker_vars(profile_name, session))
+
 
+def _login_lock(profile_name):
+    # Only one process at a time may log in to a given profile. The others
+    # wait for the lock, then find the new session in the keychain instead of
+    # logging in (and prompting for MFA) again themselves.
+    message = f"Waiting for another aws-jumpcloud process to log in to \"{profile_name}\"..."
+    return FileLock(f"login-{profile_name}", wait_message=message)
 
-def _login_to_jumpcloud(profile_name):
-    # Returns a JumpCloudSession with the user logged in. If a session already
-    # in the current process, it uses that; otherwise it creates a new one.
-    global _session
-    if _session:
-        return _session
 
+def _input_email():
+    return input("Enter your JumpCloud email address: ").strip()
+
+
+def _input_password():
+    return getpass.getpass("Enter your JumpCloud password: ").strip()
+
+
+def _get_login_details(identity):
+    # Gets the user's JumpCloud email and password from 1Password, or by
+    # asking for them. The 1Password item holds the default identity's
+    # details; it's looked up once, and both are read from it. Callers hold
+    # PROMPT_LOCK, so concurrent logins don't look it up (or prompt) at once.
+    if identity != DEFAULT_IDENTITY:
+        sys.stderr.write(f"Enter the JumpCloud login details for \"{identity}\".\n")
+        return (_input_email(), _input_password())
+    if not op.installed():
+        return (_input_email(), _input_password())
+
+    sys.stderr.write(f"1Password CLI found. Using email from item: {op.ITEM}\n")
+    email = op.get_email()
+    if not email:
+        sys.stderr.write(f"1Password email not found for item: {op.ITEM}. "
+                          "Falling back to user input.\n")
+        email = _input_email()
+
+    sys.stderr.write(f"1Password CLI found. Using password from item: {op.ITEM}\n")
+    password = op.get_password()
+    if not password:
+        sys.stderr.write(f"1Password password not found for item: {op.ITEM}. "
+                          "Falling back to user input.\n")
+        password = _input_password()
+    return (email, password)
+
+
+def _login_to_jumpcloud(profile_name, identity=DEFAULT_IDENTITY, profile_names=None):
+    # Returns a JumpCloudSession with the identity logged in. If the identity
+    # has already logged in in the current process (perhaps in another
+    # thread), it uses that session; otherwise it creates a new one.
+    # profile_names are the profiles that the login is for (by default, just
+    # profile_name), which its metrics are recorded against.
+    with _sessions_lock:
+        identity_lock = _identity_locks.setdefault(identity, threading.Lock())
+    with identity_lock:
+        session = _sessions.get(identity)
+        if session is None or time.monotonic() - session.logged_in_at > JUMPCLOUD_SESSION_MAX_AGE:
+            _sessions[identity] = _new_jumpcloud_session(profile_name, identity,
+                                                         profile_names or [profile_name])
+        return _sessions[identity]
+
+
+def _forget_jumpcloud_session(identity, session):
+    # Makes the next _login_to_jumpcloud() for the identity log in again
+    with _sessions_lock:
+        if _sessions.get(identity) is session:
+            del _sessions[identity]
+
+
+def _new_jumpcloud_session(profile_name, identity, profile_names):
+    # The login is a pipeline: the XSRF token request and (for accounts that
+    # needed MFA last time) the 1Password TOTP lookup run in the background
+    # while we read the keychain and look up the email and password.
+    _exit_if_circuit_open("jumpcloud")
+    session = JumpCloudSession(identity=identity, interactive=_can_prompt())
+    session.profile_names = profile_names
+    session.prefetch_xsrf_token()
     keyring = Keyring()
-    email = keyring.get_jumpcloud_email()
-    password = keyring.get_jumpcloud_password()
+    session.mfa_seed = keyring.get_jumpcloud_mfa_seed(identity)
+    mfa_required = keyring.get_jumpcloud_mfa_required(identity)
+    if mfa_required:
+        session.prefetch_mfa()
+    email = keyring.get_jumpcloud_email(identity)
+    password = keyring.get_jumpcloud_password(identity)
+    details = "JumpCloud login details"
+    if identity != DEFAULT_IDENTITY:
+        details += f" for \"{identity}\""
     if email and password:
-        sys.stderr.write("Using JumpCloud login details from your OS keychain.\n")
-    elif sys.stdout.isatty():
-        email = _get_email()
-        password = _get_password()
-        keyring.store_jumpcloud_email(email)
-        keyring.store_jumpcloud_password(password)
-        sys.stderr.write("JumpCloud login details saved in your OS keychain.\n")
+        sys.stderr.write(f"Using {details} from your OS keychain.\n")
+    elif _can_prompt():
+        with PROMPT_LOCK:
+            (email, password) = _get_login_details(identity)
+        keyring.store_jumpcloud_email(email, identity=identity)
+        keyring.store_jumpcloud_password(password, identity=identity)
+        sys.stderr.write(f"{details} saved in your OS keychain.\n")
     else:
-        _print_error("Error: JumpCloud login details not found in your OS keychain. "
+        _print_error(f"Error: {details} not found in your OS keychain. "
                      f"Run \"{_get_program_name()} rotate {profile_name}\" interactively "
                      "to store your credentials in the keychain, then try again.")
         sys.exit(1)
 
-    session = JumpCloudSession(email, password)
+    session.email = email
+    session.password = password
     try:
-        session.login()
+        with metrics.timed("jumpcloud_login", profiles=profile_names), \
+                circuit_breaker.watch("jumpcloud", _is_outage):
+            session.login(mfa_required=mfa_required)
+    except RequestException as e:
+        sys.stderr.write("\n")
+        _print_error(f"Error: Couldn't reach JumpCloud ({e.__class__.__name__}).")
+        sys.exit(1)
     except JumpCloudError as e:
         sys.stderr.write("\n")
         _print_error(f"Error: {e.message}")
         if isinstance(e, JumpCloudAuthFailure):
-            keyring.store_jumpcloud_email(None)
-            keyring.store_jumpcloud_password(None)
+            keyring.store_jumpcloud_email(None, identity=identity)
+            keyring.store_jumpcloud_password(None, identity=identity)
             _print_error("- You will be prompted for your username and password the next time you try.")
         elif isinstance(e, JumpCloudMFARequired):
             _print_error(f"Run \"{_get_program_name()} rotate {profile_name}\" interactively to "
-                         "refresh the temporary credentials in your OS keychain, then try again.")
+                         "refresh the temporary credentials in your OS keychain, then try again. "
+                         f"(Or store your MFA seed with \"{_get_program_name()} mfa-seed set\", so that "
+                         "MFA codes can be generated without prompting.)")
+        elif isinstance(e, JumpCloudMFAFailure) and session.mfa_seed:
+            _print_error("- The MFA code was generated from the seed in your OS keychain. If the seed is "
+                         f"wrong, store the right one with \"{_get_program_name()} mfa-seed set\".")
         elif isinstance(e, JumpCloudServerError):
             _print_error(f"- JumpCloud error message: {e.jumpcloud_error_message or e.response.text}")
         sys.exit(1)
-
-    _session = session
-    return _session
+    return session
 
 
-def _login_to_aws(keyring, profile):
-    # Returns an AWSSession with temporary credentials for the given profile.
-    session = _login_to_jumpcloud(profile.name)
-    sys.stderr.write("Attempting SSO authentication to Amazon Web Services...\n")
+def _get_saml_assertion(keyring, profile, retry=True):
+    # Returns a SAML assertion for the profile, and whether it came from the
+    # cache. Only logs in to JumpCloud if there isn't a usable cached one.
+    saml_assertion = saml_cache.get(keyring, profile)
+    if saml_assertion is not None:
+        metrics.record("saml_cache_hit", profile.name)
+        return (saml_assertion, True)
+    reused = profile.identity_name in _sessions
+    session = _login_to_jumpcloud(profile.name, profile.identity_name)
     try:
-        saml_assertion = session.get_aws_saml_assertion(profile)
+        with metrics.timed("saml_assertion", profile.name), circuit_breaker.watch("jumpcloud", _is_outage):
+            saml_assertion = session.get_aws_saml_assertion(profile)
+    except RequestException as e:
+        _forget_jumpcloud_session(profile.identity_name, session)
+        sys.stderr.write("\n")
+        _print_error(f"Error: Couldn't reach JumpCloud ({e.__class__.__name__}).")
+        sys.exit(1)
     except JumpCloudError as e:
+        # JumpCloud may have expired the session, if it's from an earlier
+        # login in this process, so log in again and retry once
+        _forget_jumpcloud_session(profile.identity_name, session)
+        if reused and retry:
+            return _get_saml_assertion(keyring, profile, retry=False)
         sys.stderr.write("\n")
         _print_error(f"Error: {e.message}")
         if isinstance(e, JumpCloudServerError):
@@ -295,6 +841,17 @@ def _login_to_aws(keyring, profile):
                          f"the Single Sign-On Applications has the URL \"{profile.jumpcloud_url}\". If "
                          "the URL is correct, aws-jumpcloud may need to be updated.")
         sys.exit(1)
+    saml_cache.store(keyring, profile, saml_assertion)
+    return (saml_assertion, False)
+
+
+def _login_to_aws(keyring, profile):
+    # Returns an AWSSession with temporary credentials for the given profile.
+    open_service = _get_open_circuit(keyring, profile)
+    if open_service:
+        _exit_if_circuit_open(open_service)
+    sys.stderr.write("Attempting SSO authentication to Amazon Web Services...\n")
+    (saml_assertion, from_cache) = _get_saml_assertion(keyring, profile)
     roles = get_assertion_roles(saml_assertion)
 
     # Warning: It's a valid JumpCloud configuration to present more than one
@@ -312,11 +869,31 @@ def _login_to_aws(keyring, profile):
         profile.aws_role = r.aws_role
         keyring.store_profile(profile)
 
-    session = assume_role_with_saml(role, saml_assertion)
+    sts_endpoints = get_sts_endpoints(profile.sts_region)
+    duration_setting = _get_duration_setting(profile)
+    durations = get_duration_candidates(duration_setting, profile.max_session_duration)
+    while True:
+        try:
+            with metrics.timed("sts_assume_role_with_saml", profile.name), \
+                    circuit_breaker.watch("sts", _is_outage):
+                (session, duration) = assume_with_longest_duration(
+                    lambda d: assume_role_with_saml(role, saml_assertion, sts_endpoints, duration=d),
+                    durations)
+            break
+        except Exception as e:
+            # If STS won't accept a cached assertion after all, get a fresh one
+            if not from_cache or not is_assertion_rejected(e):
+                raise
+            saml_cache.discard(keyring, profile)
+            (saml_assertion, from_cache) = _get_saml_assertion(keyring, profile)
+    if duration_setting == MAX_DURATION and duration != profile.max_session_duration:
+        profile.max_session_duration = duration
+        keyring.store_profile(profile)
 
     # Update the AWS account alias on each login. The alias refers to the
     # account used to login, not any assumed role (which happens below).
-    alias = get_account_alias(session)
+    with metrics.timed("iam_account_alias", profile.name):
+        alias = get_account_alias(session)
     if alias != profile.aws_account_alias:
         profile.aws_account_alias = alias
         keyring.store_profile(profile)
@@ -326,15 +903,52 @@ def _login_to_aws(keyring, profile):
             profile.role_to_assume.aws_account_id = profile.aws_account_id
             keyring.store_profile(profile)
         sys.stderr.write(f"Assuming role {profile.role_to_assume.arn}...\n")
-        email = keyring.get_jumpcloud_email()
+        email = keyring.get_jumpcloud_email(profile.identity_name)
         role_session_name = get_role_session_name(email)
-        session = assume_role(session, profile.role_to_assume, role_session_name)
+        role_to_assume = profile.role_to_assume
+        # AWS allows chained role sessions an hour at most, whatever the
+        # duration setting
+        durations = get_duration_candidates(duration_setting, role_to_assume.max_session_duration,
+                                            limit=ROLE_CHAINING_MAX_DURATION)
+        with metrics.timed("sts_assume_role", profile.name), circuit_breaker.watch("sts", _is_outage):
+            (session, duration) = assume_with_longest_duration(
+                lambda d: assume_role(session, role_to_assume, role_session_name, sts_endpoints,
+                                      duration=d),
+                durations)
+        if duration_setting == MAX_DURATION and duration != role_to_assume.max_session_duration:
+            role_to_assume.max_session_duration = duration
+            keyring.store_profile(profile)
 
     keyring.store_session(profile.name, session)
     sys.stderr.write("\n")
     return session
 
 
+def _get_duration_setting(profile):
+    if profile.session_duration:
+        return profile.session_duration
+    elif os.environ.get(DURATION_ENV_VAR):
+        return _parse_duration(os.environ[DURATION_ENV_VAR], DURATION_ENV_VAR)
+    else:
+        return None
+
+
+def _parse_duration(value, source):
+    # Parses a session duration like "3600", "90m" or "12h" into seconds, or
+    # returns "max" as-is.
+    if value == MAX_DURATION:
+        return MAX_DURATION
+    match = DURATION_REGEXP.match(value.strip())
+    if match:
+        seconds = int(match.group(1)) * {"": 1, "s": 1, "m": 60, "h": 60 * 60}[match.group(2)]
+        if 15 * 60 <= seconds <= 12 * 60 * 60:
+            return seconds
+    _print_error(f"Error: Invalid session duration \"{value}\" in {source}. Use a number of seconds, "
+                 "minutes (e.g. \"90m\") or hours (e.g. \"12h\") between 15 minutes and 12 hours, "
+                 "or \"max\".")
+    sys.exit(1)
+
+
 def _which(command):
     # Find the full path to the program that the user wants to run, otherwise
     # subprocess.run() won't be able to find it. (I'm not sure exactly why this
@@ -350,6 +964,10 @@ def _which(command):
     return result.stdout.strip()
 
 
+def _can_prompt():
+    return sys.stdout.isatty() and not getattr(_non_interactive, "active", False)
+
+
 def _get_program_name():
     return sys.argv[0]
 
@@ -373,7 +991,7 @@ def _format_profile_rows(profiles, sessions):
     return rows
 
 
-def _print_columns(headers, rows):
+def _print_columns(headers, rows, file=sys.stdout):
     sizes = []
     for value in headers:
         sizes.append(len(value))
@@ -381,10 +999,10 @@ def _print_columns(headers, rows):
         for i, value in enumerate(row):
             sizes[i] = max(sizes[i], len(value) + 2)
 
-    print("".join([value.ljust(size + 2) for size, value in zip(sizes, headers)]))
-    print("  ".join(["=" * size for size in sizes]))
+    print("".join([value.ljust(size + 2) for size, value in zip(sizes, headers)]), file=file)
+    print("  ".join(["=" * size for size in sizes]), file=file)
     for row in rows:
-        print("".join([value.ljust(size + 2) for size, value in zip(sizes, row)]))
+        print("".join([value.ljust(size + 2) for size, value in zip(sizes, row)]), file=file)
 
 
 def _print_error(message):
@@ -0,0 +1,83 @@
+import os
+import re
+
+from aws_jumpcloud.state import write_atomically
+
+# Same default location, and the same override, that the AWS CLI and SDKs use.
+DEFAULT_CREDENTIALS_FILE = os.path.join("~", ".aws", "credentials")
+
+SECTION_HEADER_REGEXP = re.compile(r"^\s*\[\s*([^\]]+?)\s*\]\s*$")
+
+# Marks the sections that aws-jumpcloud wrote, which are the only ones it
+# removes once their sessions expire; a section with the same name that
+# someone wrote by hand (e.g. with long-lived keys) is left alone.
+SECTION_MARKER = "# Written by aws-jumpcloud sync-credentials; removed when the session expires.\n"
+
+
+def get_default_path():
+    path = os.environ.get("AWS_SHARED_CREDENTIALS_FILE") or DEFAULT_CREDENTIALS_FILE
+    return os.path.expanduser(path)
+
+
+def write_sessions(path, sessions, remove=()):
+    """Writes the given AWS sessions (a dict of profile name to AWSSession)
+    into a shared credentials file, replacing any existing sections with the
+    same names, and dropping those of the sections listed in `remove` that
+    it wrote itself. Every other section, comment and blank line is
+    preserved as-is. The file is replaced atomically, so concurrent readers
+    never see a partially written file. Returns True if the file contents
+    changed."""
+    old_text = _read(path)
+    new_text = _render(old_text, sessions, set(remove))
+    if new_text == old_text:
+        return False
+    write_atomically(path, new_text)
+    return True
+
+
+def _read(path):
+    try:
+        with open(path, "r") as f:
+            return f.read()
+    except FileNotFoundError:
+        return ""
+
+
+def _render(text, sessions, remove):
+    # Splits the file into sections (keeping everything before the first
+    # section header as a preamble), replaces or removes the sections we
+    # manage, and appends sections for profiles that weren't in the file yet.
+    blocks = _split_sections(text)
+    lines = []
+    written = set()
+    for (name, block_lines) in blocks:
+        if name is None or not (name in sessions or (name in remove and SECTION_MARKER in block_lines)):
+            lines.extend(block_lines)
+        elif name in sessions and name not in written:
+            lines.extend(_format_section(name, sessions[name]))
+            written.add(name)
+    for name in sorted(sessions.keys()):
+        if name not in written:
+            if lines and lines[-1].strip():
+                lines.append("\n")
+            lines.extend(_format_section(name, sessions[name]))
+    return "".join(lines)
+
+
+def _split_sections(text):
+    blocks = [(None, [])]
+    for line in text.splitlines(keepends=True):
+        match = SECTION_HEADER_REGEXP.match(line)
+        if match:
+            blocks.append((match.group(1), []))
+        blocks[-1][1].append(line if line.endswith("\n") else line + "\n")
+    return blocks
+
+
+def _format_section(name, session):
+    return [f"[{name}]\n",
+            SECTION_MARKER,
+            f"aws_access_key_id = {session.access_key_id}\n",
+            f"aws_secret_access_key = {session.secret_access_key}\n",
+            f"aws_session_token = {session.session_token}\n",
+            "\n"]
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import secrets
+import sys
+import threading
+
+# "aws-jumpcloud exec --rotate" serves the profile's credentials to the
+# command from a local endpoint, in the format of the ECS container
+# credentials endpoint, instead of putting them in its environment. AWS SDKs
+# and the AWS CLI fetch credentials from there again whenever theirs are
+# about to expire, so the command keeps working for longer than one session.
+#
+# SDKs start asking for new credentials 15 minutes before theirs expire, so
+# the session is replaced 20 minutes before it expires, or halfway through its
+# life if it's shorter than that. A failed refresh is retried every minute.
+REFRESH_BEFORE_EXPIRY = timedelta(minutes=20)
+REFRESH_RETRY_INTERVAL = 60  # in seconds
+
+
+class CredentialsServer(object):
+    def __init__(self, session, refresh):
+        """`session` is the AWSSession to serve first. `refresh` is called
+        with the current session when it's time to replace it, and returns a
+        new AWSSession."""
+        self._session = session
+        self._refresh = refresh
+        self._obtained_at = datetime.now(timezone.utc)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.token = secrets.token_urlsafe(32)
+        self._server = HTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.credentials_server = self
+
+    def get_environment_vars(self):
+        return {"AWS_CONTAINER_CREDENTIALS_FULL_URI": f"http://127.0.0.1:{self._server.server_port}/",
+                "AWS_CONTAINER_AUTHORIZATION_TOKEN": self.token}
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        threading.Thread(target=self._refresh_periodically, daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def get_session(self):
+        with self._lock:
+            return self._session
+
+    def _refresh_periodically(self):
+        while True:
+            with self._lock:
+                session = self._session
+                lifetime = session.expires_at - self._obtained_at
+            refresh_at = max(session.expires_at - REFRESH_BEFORE_EXPIRY, self._obtained_at + lifetime / 2)
+            delay = (refresh_at - datetime.now(timezone.utc)).total_seconds()
+            if self._stopped.wait(max(0, delay)):
+                return
+            try:
+                new_session = self._refresh(session)
+            except (Exception, SystemExit):
+                sys.stderr.write("aws-jumpcloud: couldn't refresh the temporary IAM session; "
+                                 f"will try again in {REFRESH_RETRY_INTERVAL} seconds.\n")
+                if self._stopped.wait(REFRESH_RETRY_INTERVAL):
+                    return
+                continue
+            with self._lock:
+                self._session = new_session
+                self._obtained_at = datetime.now(timezone.utc)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        credentials_server = self.server.credentials_server
+        if not secrets.compare_digest(self.headers.get("Authorization", ""), credentials_server.token):
+            self._respond(401, {"message": "Unauthorized"})
+            return
+        session = credentials_server.get_session()
+        self._respond(200, {"AccessKeyId": session.access_key_id,
+                            "SecretAccessKey": session.secret_access_key,
+                            "Token": session.session_token,
+                            "Expiration": session.expires_at.strftime("%Y-%m-%dT%H:%M:%SZ")})
+
+    def _respond(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,97 @@
+import base64
+from datetime import datetime, timedelta, timezone
+import json
+import os
+
+from aws_jumpcloud.sigv4 import presign_url
+from aws_jumpcloud.state import get_state_path, write_atomically
+
+# An EKS authentication token is a presigned STS GetCallerIdentity URL, with
+# the cluster name in a signed header. EKS accepts it for 15 minutes after
+# signing; like "aws eks get-token", we tell kubectl it expires after 14.
+TOKEN_PREFIX = "k8s-aws-v1."
+CLUSTER_ID_HEADER = "x-k8s-aws-id"
+PRESIGN_EXPIRES = 60  # in seconds
+TOKEN_LIFETIME = timedelta(minutes=14)
+
+# Tokens are cached in the state directory and served until this long before
+# they expire, so that kubectl never receives a token that expires before its
+# request completes. (Like the caches of "aws eks get-token" and kubectl
+# itself, the cache file is only readable by the current user.)
+CACHE_MARGIN = timedelta(minutes=1)
+CACHE_FILENAME = "eks-tokens.json"
+
+DEFAULT_REGION = "us-east-1"
+DEFAULT_API_VERSION = "client.authentication.k8s.io/v1beta1"
+
+
+def get_region(region=None):
+    return region or os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION") or DEFAULT_REGION
+
+
+def build_exec_credential(session, cluster_name, region, now=None):
+    """Returns a client.authentication.k8s.io ExecCredential (as a dict) for
+    the given cluster, signed locally with the given AWSSession. This makes no
+    network requests."""
+    now = now or datetime.now(timezone.utc)
+    url = presign_url(f"https://sts.{region}.amazonaws.com/?Action=GetCallerIdentity&Version=2011-06-15",
+                      region, "sts", session, PRESIGN_EXPIRES,
+                      headers={CLUSTER_ID_HEADER: cluster_name}, now=now)
+    token = TOKEN_PREFIX + base64.urlsafe_b64encode(url.encode("utf-8")).decode("ascii").rstrip("=")
+    # The token stops working when the credentials that signed it expire
+    expires_at = min(now + TOKEN_LIFETIME, session.expires_at)
+    return {"kind": "ExecCredential",
+            "apiVersion": _get_api_version(),
+            "spec": {},
+            "status": {"expirationTimestamp": expires_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                       "token": token}}
+
+
+def read_cached_credential(profile_name, cluster_name, region):
+    """Returns the cached ExecCredential for the given profile and cluster,
+    or None if there isn't one that's valid for long enough."""
+    credential = _read_cache().get(_cache_key(profile_name, cluster_name, region))
+    if credential is None:
+        return None
+    expires_at = datetime.strptime(credential["status"]["expirationTimestamp"], "%Y-%m-%dT%H:%M:%SZ")
+    if expires_at.replace(tzinfo=timezone.utc) - CACHE_MARGIN < datetime.now(timezone.utc):
+        return None
+    credential["apiVersion"] = _get_api_version()
+    return credential
+
+
+def write_cached_credential(profile_name, cluster_name, region, credential):
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    cache = dict([(k, v) for (k, v) in _read_cache().items() if v["status"]["expirationTimestamp"] > now])
+    cache[_cache_key(profile_name, cluster_name, region)] = credential
+    write_atomically(get_state_path(CACHE_FILENAME), json.dumps(cache))
+
+
+def delete_cached_credentials(profile_name=None):
+    """Removes the cached tokens for the given profile, or for all profiles."""
+    cache = _read_cache()
+    remaining = dict([(k, v) for (k, v) in cache.items()
+                      if profile_name is not None and json.loads(k)[0] != profile_name])
+    if remaining != cache:
+        write_atomically(get_state_path(CACHE_FILENAME), json.dumps(remaining))
+
+
+def _get_api_version():
+    # kubectl tells exec plugins which API version it expects
+    try:
+        exec_info = json.loads(os.environ.get("KUBERNETES_EXEC_INFO") or "{}")
+    except ValueError:
+        exec_info = {}
+    return exec_info.get("apiVersion") or DEFAULT_API_VERSION
+
+
+def _cache_key(profile_name, cluster_name, region):
+    return json.dumps([profile_name, cluster_name, region])
+
+
+def _read_cache():
+    try:
+        with open(get_state_path(CACHE_FILENAME), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
@@ -0,0 +1,59 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import subprocess
+from subprocess import PIPE
+import sys
+import threading
+import time
+
+# Output modes: "prefix" streams each line of output as it arrives, prefixed
+# with the profile name; "collect" prints each command's output in one block
+# after it finishes.
+OUTPUT_PREFIX = "prefix"
+OUTPUT_COLLECT = "collect"
+
+ExecResult = namedtuple("ExecResult", ["name", "returncode", "duration"])
+
+
+def run_all(command, environments, jobs, output_mode):
+    """Runs the command once for each (name, environment variables) pair, at
+    most `jobs` at a time. Returns a list of ExecResults, in the same order
+    as the environments."""
+    output_lock = threading.Lock()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(_run_one, name, command, env, output_mode, output_lock)
+                   for (name, env) in environments]
+        return [f.result() for f in futures]
+
+
+def _run_one(name, command, env, output_mode, output_lock):
+    start = time.monotonic()
+    proc = subprocess.Popen(command, env=env, stdin=subprocess.DEVNULL, stdout=PIPE, stderr=PIPE)
+    if output_mode == OUTPUT_COLLECT:
+        (stdout, stderr) = proc.communicate()
+        with output_lock:
+            sys.stdout.flush()
+            sys.stdout.buffer.write(f"==> {name} (exit code {proc.returncode}) <==\n".encode("utf-8"))
+            sys.stdout.buffer.write(stdout)
+            sys.stdout.buffer.flush()
+            sys.stderr.buffer.write(stderr)
+            sys.stderr.buffer.flush()
+    else:
+        prefix = f"[{name}] ".encode("utf-8")
+        stderr_thread = threading.Thread(target=_copy_lines,
+                                         args=(proc.stderr, sys.stderr.buffer, prefix, output_lock))
+        stderr_thread.start()
+        _copy_lines(proc.stdout, sys.stdout.buffer, prefix, output_lock)
+        stderr_thread.join()
+        proc.wait()
+    return ExecResult(name, proc.returncode, time.monotonic() - start)
+
+
+def _copy_lines(source, dest, prefix, output_lock):
+    for line in iter(source.readline, b""):
+        if not line.endswith(b"\n"):
+            line += b"\n"
+        with output_lock:
+            dest.write(prefix + line)
+            dest.flush()
+    source.close()
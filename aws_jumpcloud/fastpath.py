@@ -0,0 +1,62 @@
+# Commands that shells and other tools run very frequently (for example, on
+# every prompt render). They must stay cheap: nothing in this module may
+# import boto3, keyring or aws_jumpcloud.commands at the top level, and they
+# only fall back to the full implementation when their fast answer isn't
+# available.
+import json
+import shutil
+import subprocess
+import sys
+
+import aws_jumpcloud.eks as eks
+import aws_jumpcloud.inherited_session as inherited_session
+import aws_jumpcloud.metrics as metrics
+import aws_jumpcloud.session_index as session_index
+
+
+def is_active(args):
+    active = session_index.is_active(args.profile)
+    if active is None:
+        # The index hasn't been written yet (e.g. right after upgrading), so
+        # check the keychain. Loading the keychain also writes the index.
+        from aws_jumpcloud import commands
+        commands.is_active(args)
+    elif active:
+        print(1)
+
+
+def eks_token(args):
+    region = eks.get_region(args.region)
+    credential = eks.read_cached_credential(args.profile, args.cluster, region)
+    if credential is None:
+        from aws_jumpcloud import commands
+        commands.eks_token(args)
+    else:
+        print(json.dumps(credential))
+
+
+def exec_command(args):
+    # Returns False to fall back to the full implementation
+    if args.all or args.profiles or args.rotate or not args.profile:
+        return False
+    env = inherited_session.get_inherited_vars(args.profile)
+    if env is None:
+        return False
+    metrics.record("session_cache_hit", args.profile)
+    program = shutil.which(args.command[0])
+    if program is None:
+        sys.stderr.write(f"{args.command[0]}: command not found\n")
+        sys.exit(127)
+    result = subprocess.run([program] + args.command[1:])
+    sys.exit(result.returncode)
+
+
+def export_vars(args):
+    # Returns False to fall back to the full implementation
+    env = inherited_session.get_inherited_vars(args.profile)
+    if env is None:
+        return False
+    metrics.record("session_cache_hit", args.profile)
+    for (name, value) in env.items():
+        print(f"export {name}=\"{value}\"")
+    return True
@@ -0,0 +1,36 @@
+from datetime import datetime, timezone
+
+# Profiles that don't name an identity use this one, which holds the JumpCloud
+# login details that aws-jumpcloud stored before identities existed.
+DEFAULT_IDENTITY = "default"
+
+
+class Identity(object):
+    """A JumpCloud user account (e.g. in one of several JumpCloud
+    organizations), with its own login details, MFA seed and login history.
+    Each profile logs in as one identity."""
+    __slots__ = ["name", "email", "password", "timestamp", "mfa_required", "mfa_seed"]
+
+    def __init__(self, name, email=None, password=None):
+        self.name = name
+        self.email = email
+        self.password = password
+        self.timestamp = None  # of the last successful login
+        self.mfa_required = False  # whether the last login needed an MFA code
+        self.mfa_seed = None
+
+    def to_dict(self):
+        return {"email": self.email,
+                "password": self.password,
+                "timestamp": self.timestamp.timestamp() if self.timestamp else None,
+                "mfa_required": self.mfa_required,
+                "mfa_seed": self.mfa_seed}
+
+    @classmethod
+    def from_dict(cls, name, data):
+        i = Identity(name, email=data.get("email") or None, password=data.get("password") or None)
+        if data.get("timestamp"):
+            i.timestamp = datetime.fromtimestamp(data["timestamp"], tz=timezone.utc)
+        i.mfa_required = data.get("mfa_required", False)
+        i.mfa_seed = data.get("mfa_seed") or None
+        return i
@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta, timezone
+import os
+
+# "aws-jumpcloud exec" and "aws-jumpcloud export" mark the environment with the
+# profile whose credentials it holds, and when they expire. A nested exec or
+# export for the same profile then reuses those credentials instead of opening
+# the keychain (and importing boto3), as long as they're still valid.
+PROFILE_ENV_VAR = "AWS_JUMPCLOUD_PROFILE"
+EXPIRES_AT_ENV_VAR = "AWS_JUMPCLOUD_EXPIRES_AT"
+CREDENTIAL_ENV_VARS = ["AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY",
+                       "AWS_SECURITY_TOKEN", "AWS_SESSION_TOKEN"]
+
+# Inherited credentials that expire sooner than this are ignored, so that the
+# nested command gets the session from the keychain (logging in again if
+# that one has expired too) rather than credentials that are about to stop
+# working.
+REFRESH_MARGIN = timedelta(minutes=5)
+
+
+def get_marker_vars(profile_name, session):
+    """Returns the environment variables that mark an AWSSession's
+    credentials as belonging to the profile."""
+    return {PROFILE_ENV_VAR: profile_name,
+            EXPIRES_AT_ENV_VAR: str(int(session.expires_at.timestamp()))}
+
+
+def get_inherited_vars(profile_name, environ=os.environ):
+    """Returns the credential and marker environment variables inherited from
+    a parent exec/export of the same profile, or None if there aren't any
+    (or they are for another profile, incomplete, or about to expire)."""
+    if environ.get(PROFILE_ENV_VAR) != profile_name:
+        return None
+    try:
+        expires_at = datetime.fromtimestamp(int(environ.get(EXPIRES_AT_ENV_VAR, "")), tz=timezone.utc)
+    except ValueError:
+        return None
+    if expires_at - REFRESH_MARGIN < datetime.now(timezone.utc):
+        return None
+    if not all([environ.get(name) for name in CREDENTIAL_ENV_VARS]):
+        return None
+    names = CREDENTIAL_ENV_VARS + [PROFILE_ENV_VAR, EXPIRES_AT_ENV_VAR]
+    return dict([(name, environ[name]) for name in names])
@@ -1,51 +1,128 @@
 import base64
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from json import JSONDecodeError
+import os
 import sys
+import threading
+import time
 
 from bs4 import BeautifulSoup  # pylint: disable=E0401
 from requests import Session as HTTPSession
 
+from aws_jumpcloud.identity import DEFAULT_IDENTITY
 from aws_jumpcloud.keyring import Keyring
+import aws_jumpcloud.metrics as metrics
 import aws_jumpcloud.onepassword as op
+import aws_jumpcloud.totp as totp
+
+
+# The JumpCloud User Console. Accounts in JumpCloud's EU region use
+# https://console.eu.jumpcloud.com instead.
+CONSOLE_URL_ENV_VAR = "AWS_JUMPCLOUD_CONSOLE_URL"
+DEFAULT_CONSOLE_URL = "https://console.jumpcloud.com"
+
+# A TOTP code fetched in the background is only used if it's fresher than
+# this; otherwise (e.g. the user took a while to type their password) we
+# fetch a new one.
+PREFETCHED_TOTP_MAX_AGE = 15  # in seconds
+
+# Several identities can log in at once, in different threads, but only one
+# of them may prompt the user at a time.
+PROMPT_LOCK = threading.Lock()
 
 
 class JumpCloudSession(object):
     HTTP_TIMEOUT = 5
 
-    def __init__(self, email, password):
+    def __init__(self, email=None, password=None, mfa_seed=None, identity=DEFAULT_IDENTITY,
+                 interactive=None):
+        # The email and password may be set later, after prefetch_xsrf_token().
+        # Unless the session is interactive (by default, if stdout is a
+        # terminal), it never prompts for an MFA code.
+        self.identity = identity
+        self.interactive = sys.stdout.isatty() if interactive is None else interactive
         self.email = email
         self.password = password
+        self.mfa_seed = mfa_seed  # if set, MFA codes are generated from it
+        self.profile_names = []  # the profiles being logged in to, for metrics
         self.http = HTTPSession()
         self.logged_in = False
+        self.logged_in_at = None  # time.monotonic() of the login
         self.xsrf_token = None
-
-    def login(self):
+        self.console_url = os.environ.get(CONSOLE_URL_ENV_VAR) or DEFAULT_CONSOLE_URL
+        self._executor = ThreadPoolExecutor(max_workers=2)
+        self._xsrf_future = None
+        self._totp_future = None
+        self._totp_requested_at = None
+
+    def prefetch_xsrf_token(self):
+        # Starts fetching the XSRF token in the background, so that it's ready
+        # by the time we've looked up the user's email and password.
+        self._xsrf_future = self._executor.submit(self._fetch_xsrf_token)
+
+    def prefetch_mfa(self):
+        # For accounts that are known to need MFA: starts getting a code from
+        # 1Password in the background.
+        if self.mfa_seed is None and self.interactive and self._use_1password():
+            self._totp_future = self._executor.submit(op.get_totp)
+            self._totp_requested_at = time.monotonic()
+
+    def login(self, mfa_required=False):
+        # If the account is known to need MFA, get the code before the first
+        # auth request, so that one request is enough.
+        otp = None
+        if mfa_required and self._can_get_mfa():
+            otp = self._get_mfa()
         try:
-            self._authenticate()
+            self._authenticate(otp=otp)
         except JumpCloudMFARequired as e:
-            if sys.stdout.isatty():
+            if self._can_get_mfa():
                 otp = self._get_mfa()
                 self._authenticate(otp=otp)
             else:
                 raise e
 
-    def _get_mfa(self):
-        if op.installed():
-            sys.stderr.write(f"1Password CLI found. Using OTP from item: {op.ITEM}\n")
-            mfa = op.get_totp()
+    def _can_get_mfa(self):
+        return self.mfa_seed is not None or self.interactive
 
-            if mfa:
-                return mfa
+    def _get_mfa(self):
+        if self.mfa_seed is not None:
+            metrics.record("mfa_totp", profiles=self.profile_names)
+            return totp.get_unused_code(self.mfa_seed)
+        metrics.record("mfa_prompt", profiles=self.profile_names)
+        with PROMPT_LOCK:
+            if self._use_1password():
+                sys.stderr.write(f"1Password CLI found. Using OTP from item: {op.ITEM}\n")
+                mfa = self._get_prefetched_totp() or op.get_totp()
+
+                if mfa:
+                    return mfa
+                else:
+                    sys.stderr.write(f"1Password OTP not configured for item: {op.ITEM}. "
+                                      "Falling back to user input.\n")
+                    return self._input_mfa()
             else:
-                sys.stderr.write(f"1Password OTP not configured for item: {op.ITEM}. "
-                                  "Falling back to user input.\n")
                 return self._input_mfa()
-        else:
-            return self._input_mfa()
+
+    def _use_1password(self):
+        # The 1Password item holds the default identity's login details
+        return self.identity == DEFAULT_IDENTITY and op.installed()
+
+    def _get_prefetched_totp(self):
+        future = self._totp_future
+        self._totp_future = None
+        if future is None or time.monotonic() - self._totp_requested_at > PREFETCHED_TOTP_MAX_AGE:
+            return None
+        try:
+            return future.result()
+        except Exception:
+            return None  # fall back to fetching it again, in the foreground
 
     def _input_mfa(self):
-        return input("Enter your JumpCloud multi-factor auth code: ").strip()
+        if self.identity == DEFAULT_IDENTITY:
+            return input("Enter your JumpCloud multi-factor auth code: ").strip()
+        return input(f"Enter your JumpCloud multi-factor auth code for \"{self.identity}\": ").strip()
 
     def _authenticate(self, otp=None):
         assert(not self.logged_in)
@@ -58,14 +135,16 @@ class JumpCloudSession(object):
             data['otp'] = otp
 
         auth_resp = self.http.post(
-            "https://console.jumpcloud.com/userconsole/auth",
+            f"{self.console_url}/userconsole/auth",
             headers=headers, json=data, allow_redirects=False,
             timeout=JumpCloudSession.HTTP_TIMEOUT
         )
 
         if auth_resp.status_code == 200:
             self.logged_in = True
-            Keyring().store_jumpcloud_timestamp(datetime.now(tz=timezone.utc))
+            self.logged_in_at = time.monotonic()
+            Keyring().store_jumpcloud_login(datetime.now(tz=timezone.utc), mfa_required=otp is not None,
+                                            identity=self.identity)
         else:
             raise self._auth_failure_exception(auth_resp, otp)
 
@@ -99,15 +178,21 @@ class JumpCloudSession(object):
 
     def _get_xsrf_token(self):
         if self.xsrf_token is None:
-            xsrf_resp = self.http.get("https://console.jumpcloud.com/userconsole/xsrf",
-                                      timeout=JumpCloudSession.HTTP_TIMEOUT)
-            assert(xsrf_resp.status_code == 200)
-            self.xsrf_token = xsrf_resp.json().get("xsrf")
+            if self._xsrf_future is not None:
+                self.xsrf_token = self._xsrf_future.result()
+            else:
+                self.xsrf_token = self._fetch_xsrf_token()
         return self.xsrf_token
 
+    def _fetch_xsrf_token(self):
+        xsrf_resp = self.http.get(f"{self.console_url}/userconsole/xsrf",
+                                  timeout=JumpCloudSession.HTTP_TIMEOUT)
+        assert(xsrf_resp.status_code == 200)
+        return xsrf_resp.json().get("xsrf")
+
     def get_aws_saml_assertion(self, profile):
         assert(self.logged_in)
-        aws_resp = self.http.get(profile.jumpcloud_url)
+        aws_resp = self.http.get(profile.jumpcloud_url, timeout=JumpCloudSession.HTTP_TIMEOUT)
         if aws_resp.status_code != 200:
             raise JumpCloudUnexpectedStatus(aws_resp)
         if "SAMLResponse" not in aws_resp.text:
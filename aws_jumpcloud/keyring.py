@@ -1,56 +1,98 @@
+import base64
 from datetime import datetime, timezone
 import json
 
 import keyring
 
 from aws_jumpcloud.aws import AWSSession
+from aws_jumpcloud.lock import FileLock
+from aws_jumpcloud.identity import DEFAULT_IDENTITY, Identity
+import aws_jumpcloud.metrics as metrics
 from aws_jumpcloud.profile import Profile
+import aws_jumpcloud.session_index as session_index
+
+# Every aws-jumpcloud process holds this lock while it reads, modifies and
+# writes back the keychain data, so that concurrent processes can't
+# overwrite each other's changes.
+KEYRING_LOCK_NAME = "keyring"
+
+# Version 1 stored each profile and session as a JSON string nested inside
+# the keyring's JSON document. Version 2 stores them as plain objects, keyed
+# by profile name. Version 3 moves the JumpCloud login details into named
+# identities; the details in older versions become the default identity.
+# Data in older formats is migrated on the next save.
+SCHEMA_VERSION = 3
 
 
 class Keyring(object):
     def __init__(self, service="aws-jumpcloud", username="credentials"):
         self._keyring_service = service
         self._keyring_username = username
-        self._jumpcloud_email = None
-        self._jumpcloud_password = None
-        self._jumpcloud_timestamp = None
+        self._revision = 0
+        self._identities = None
         self._profiles = None
         self._aws_sessions = None
+        self._saml_assertions = None
 
     # Public method for removing the entire OS keyring object
     def delete_all_data(self):
-        if keyring.get_password(self._keyring_service, self._keyring_username) is not None:
-            keyring.delete_password(self._keyring_service, self._keyring_username)
+        with FileLock(KEYRING_LOCK_NAME):
+            if keyring.get_password(self._keyring_service, self._keyring_username) is not None:
+                keyring.delete_password(self._keyring_service, self._keyring_username)
+            session_index.delete_index()
         self._load()
 
-    # Public methods for working with JumpCloud login credentials
+    # Public methods for working with JumpCloud login credentials. Each
+    # identity has its own; they default to the default identity's.
 
-    def get_jumpcloud_email(self):
+    def get_all_identities(self):
         self._load()
-        return self._jumpcloud_email
+        return self._identities
 
-    def store_jumpcloud_email(self, value):
+    def delete_identity(self, name):
         self._load()
-        self._jumpcloud_email = value
-        self._save()
+        if name in self._identities:
+            self._update(lambda: self._identities.pop(name, None))
 
-    def get_jumpcloud_password(self):
-        self._load()
-        return self._jumpcloud_password
+    def get_jumpcloud_email(self, identity=DEFAULT_IDENTITY):
+        return self._get_identity_field(identity, "email")
 
-    def store_jumpcloud_password(self, value):
-        self._load()
-        self._jumpcloud_password = value
-        self._save()
+    def store_jumpcloud_email(self, value, identity=DEFAULT_IDENTITY):
+        self._update(lambda: setattr(self._get_or_add_identity(identity), "email", value))
 
-    def get_jumpcloud_timestamp(self):
-        self._load()
-        return self._jumpcloud_timestamp
+    def get_jumpcloud_password(self, identity=DEFAULT_IDENTITY):
+        return self._get_identity_field(identity, "password")
 
-    def store_jumpcloud_timestamp(self, value):
-        self._load()
-        self._jumpcloud_timestamp = value
-        self._save()
+    def store_jumpcloud_password(self, value, identity=DEFAULT_IDENTITY):
+        self._update(lambda: setattr(self._get_or_add_identity(identity), "password", value))
+
+    def get_jumpcloud_timestamp(self, identity=DEFAULT_IDENTITY):
+        return self._get_identity_field(identity, "timestamp")
+
+    def store_jumpcloud_timestamp(self, value, identity=DEFAULT_IDENTITY):
+        self._update(lambda: setattr(self._get_or_add_identity(identity), "timestamp", value))
+
+    def get_jumpcloud_mfa_required(self, identity=DEFAULT_IDENTITY):
+        """Returns True if the identity's last JumpCloud login needed an MFA
+        code."""
+        return self._get_identity_field(identity, "mfa_required") or False
+
+    def store_jumpcloud_login(self, timestamp, mfa_required, identity=DEFAULT_IDENTITY):
+        """Records a successful JumpCloud login, and whether it needed an MFA
+        code, in a single keychain write."""
+        def mutate():
+            i = self._get_or_add_identity(identity)
+            i.timestamp = timestamp
+            i.mfa_required = mfa_required
+        self._update(mutate)
+
+    def get_jumpcloud_mfa_seed(self, identity=DEFAULT_IDENTITY):
+        """Returns the TOTP seed for JumpCloud MFA, if the user has stored
+        one, so that codes can be generated without prompting."""
+        return self._get_identity_field(identity, "mfa_seed")
+
+    def store_jumpcloud_mfa_seed(self, value, identity=DEFAULT_IDENTITY):
+        self._update(lambda: setattr(self._get_or_add_identity(identity), "mfa_seed", value))
 
     # Public methods for working with AWS login profiles
 
@@ -63,15 +105,12 @@ class Keyring(object):
         return self._profiles.get(name) or ""
 
     def store_profile(self, profile):
-        self._load()
-        self._profiles[profile.name] = profile
-        self._save()
+        self._update(lambda: self._profiles.update({profile.name: profile}))
 
     def delete_profile(self, name):
         self._load()
         if name in self._profiles:
-            del self._profiles[name]
-            self._save()
+            self._update(lambda: self._profiles.pop(name, None))
 
     # Public methods for working with temporary AWS sessions
 
@@ -93,9 +132,7 @@ class Keyring(object):
         """Stores the given AWS session in the OS keyring."""
         if session.expired():
             return
-        self._load()
-        self._aws_sessions[profile_name] = session
-        self._save()
+        self._update(lambda: self._aws_sessions.update({profile_name: session}))
 
     def delete_session(self, profile_name):
         """Removes the given AWS session from the OS keyring. Does nothing
@@ -103,60 +140,140 @@ class Keyring(object):
         self._load()
         if profile_name not in self._aws_sessions:
             return
-        del self._aws_sessions[profile_name]
-        self._save()
+        self._update(lambda: self._aws_sessions.pop(profile_name, None))
+
+    # Public methods for working with cached SAML assertions
+
+    def get_saml_assertion(self, url, identity=DEFAULT_IDENTITY):
+        """Returns a (SAML assertion XML, expiration) tuple for the given SSO
+        URL and identity, or None if there isn't an unexpired assertion for
+        it."""
+        self._load()
+        return self._saml_assertions.get(_get_saml_key(url, identity))
+
+    def store_saml_assertion(self, url, saml_assertion_xml, expires_at, identity=DEFAULT_IDENTITY):
+        key = _get_saml_key(url, identity)
+        self._update(lambda: self._saml_assertions.update({key: (saml_assertion_xml, expires_at)}))
+
+    def delete_saml_assertion(self, url, identity=DEFAULT_IDENTITY):
+        self._load()
+        key = _get_saml_key(url, identity)
+        if key in self._saml_assertions:
+            self._update(lambda: self._saml_assertions.pop(key, None))
+
+    # Private methods for working with identities
+
+    def _get_identity_field(self, name, field):
+        self._load()
+        i = self._identities.get(name)
+        return getattr(i, field) if i else None
+
+    def _get_or_add_identity(self, name):
+        # Must only be called from a mutate() function passed to _update()
+        if name not in self._identities:
+            self._identities[name] = Identity(name)
+        return self._identities[name]
 
     # Private methods for working with the OS keychain
 
     def _load(self):
         """Pulls data from the OS keyring into this object. Automatically
         deletes any expired sessions found in the OS keyring."""
-        keyring_data = self._load_raw_keyring_data()
-        self._jumpcloud_email = keyring_data.get("jumpcloud_email") or None
-        self._jumpcloud_password = keyring_data.get("jumpcloud_password") or None
-        timestamp = keyring_data.get("jumpcloud_timestamp")
-        if timestamp:
-            self._jumpcloud_timestamp = datetime.fromtimestamp(timestamp, tz=timezone.utc)
-        else:
-            self._jumpcloud_timestamp = None
+        self._parse(self._load_raw_keyring_data())
+        if self._remove_expired_sessions():
+            self._update(lambda: None)
+        elif not session_index.index_exists():
+            session_index.write_expirations(self._aws_sessions)
 
-        self._profiles = {}
-        for profile_str in keyring_data.get("profiles", []):
-            p = Profile.loads(profile_str)
-            self._profiles[p.name] = p
-
-        self._aws_sessions = {}
-        for (profile, session_str) in keyring_data.get("aws_sessions", {}).items():
-            session = AWSSession.loads(session_str)
-            self._aws_sessions[profile] = session
+    def _parse(self, keyring_data):
+        self._revision = keyring_data.get("revision", 0)
+        schema_version = keyring_data.get("schema_version", 1)
+        assert(schema_version <= SCHEMA_VERSION)
+        if schema_version < 3:
+            self._identities = {}
+            legacy_fields = ["email", "password", "timestamp", "mfa_required", "mfa_seed"]
+            data = dict([(field, keyring_data.get(f"jumpcloud_{field}")) for field in legacy_fields])
+            if any(data.values()):
+                self._identities[DEFAULT_IDENTITY] = Identity.from_dict(DEFAULT_IDENTITY, data)
+        else:
+            self._identities = dict([(name, Identity.from_dict(name, i))
+                                     for (name, i) in keyring_data["identities"].items()])
 
-        self._purge_expired_sessions()
+        if schema_version == 1:
+            profiles = [Profile.loads(p) for p in keyring_data.get("profiles", [])]
+            self._profiles = dict([(p.name, p) for p in profiles])
+            self._aws_sessions = dict([(name, AWSSession.loads(s))
+                                       for (name, s) in keyring_data.get("aws_sessions", {}).items()])
+        else:
+            self._profiles = dict([(name, Profile.from_dict(p))
+                                   for (name, p) in keyring_data["profiles"].items()])
+            self._aws_sessions = dict([(name, AWSSession.from_dict(s))
+                                       for (name, s) in keyring_data["aws_sessions"].items()])
+        # Expired assertions are simply ignored, and dropped on the next save
+        now = datetime.now(timezone.utc)
+        self._saml_assertions = {}
+        for (key, a) in keyring_data.get("saml_assertions", {}).items():
+            expires_at = datetime.fromtimestamp(a["expires_at"], tz=timezone.utc)
+            if expires_at > now:
+                self._saml_assertions[key] = (base64.b64decode(a["assertion"]), expires_at)
 
     def _load_raw_keyring_data(self):
-        json_data = keyring.get_password(self._keyring_service, self._keyring_username)
+        with metrics.timed("keychain_read"):
+            json_data = keyring.get_password(self._keyring_service, self._keyring_username)
         if json_data is None:
             return {}
         else:
             return json.loads(json_data)
 
-    def _purge_expired_sessions(self):
+    def _remove_expired_sessions(self):
         expired_sessions = [name for (name, session) in self._aws_sessions.items() if session.expired()]
         for p in expired_sessions:
             del self._aws_sessions[p]
-        if expired_sessions:
-            self._save()
+        return len(expired_sessions) > 0
+
+    def _update(self, mutate):
+        """Applies a change to the latest data in the OS keyring and saves it.
+        The read-modify-write happens while holding the keyring lock, and the
+        write is a compare-and-swap on the data's revision number: if anything
+        changed the keyring since we read it (e.g. an older aws-jumpcloud that
+        doesn't use the lock), we reload and apply the change again."""
+        while True:
+            with FileLock(KEYRING_LOCK_NAME):
+                self._parse(self._load_raw_keyring_data())
+                self._remove_expired_sessions()
+                mutate()
+                if self._save():
+                    return
 
     def _save(self):
-        """Pushes data from this object into the OS keyring."""
-        if self._jumpcloud_timestamp:
-            timestamp = self._jumpcloud_timestamp.timestamp()
-        else:
-            timestamp = None
-        json_data = json.dumps({
-            "jumpcloud_email": self._jumpcloud_email,
-            "jumpcloud_password": self._jumpcloud_password,
-            "jumpcloud_timestamp": timestamp,
-            "profiles": [p.dumps() for p in self._profiles.values()],
-            "aws_sessions": dict([(k, v.dumps()) for (k, v) in self._aws_sessions.items()])
-        })
-        keyring.set_password(self._keyring_service, self._keyring_username, json_data)
+        """Pushes data from this object into the OS keyring, unless the data
+        in the keyring is no longer the revision this object was loaded from.
+        Returns True if the data was saved. Must be called with the keyring
+        lock held."""
+        if self._load_raw_keyring_data().get("revision", 0) != self._revision:
+            metrics.record("keychain_conflict")
+            return False
+        json_data = self._dumps(self._revision + 1)
+        with metrics.timed("keychain_write"):
+            keyring.set_password(self._keyring_service, self._keyring_username, json_data)
+        self._revision += 1
+        session_index.write_expirations(self._aws_sessions)
+        return True
+
+    def _dumps(self, revision):
+        return json.dumps({
+            "schema_version": SCHEMA_VERSION,
+            "revision": revision,
+            "identities": dict([(k, v.to_dict()) for (k, v) in self._identities.items()]),
+            "profiles": dict([(k, v.to_dict()) for (k, v) in self._profiles.items()]),
+            "aws_sessions": dict([(k, v.to_dict()) for (k, v) in self._aws_sessions.items()]),
+            "saml_assertions": dict([(key, {"assertion": base64.b64encode(xml).decode("ascii"),
+                                            "expires_at": expires_at.timestamp()})
+                                     for (key, (xml, expires_at)) in self._saml_assertions.items()])
+        }, separators=(",", ":"))
+
+
+def _get_saml_key(url, identity):
+    # An SSO URL issues assertions for whichever JumpCloud identity is logged
+    # in, so they're cached per identity. (URLs can't contain spaces.)
+    return f"{identity} {url}"
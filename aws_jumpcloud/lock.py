@@ -0,0 +1,78 @@
+import os
+import re
+import sys
+import time
+
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from aws_jumpcloud.state import get_state_path
+
+# Windows has no blocking whole-file lock, so we poll for it instead.
+POLL_INTERVAL = 0.05  # in seconds
+
+
+class FileLock(object):
+    """An exclusive lock shared by every aws-jumpcloud process on this
+    machine, backed by a lock file in the state directory. The OS releases
+    the lock automatically if the process holding it exits or crashes, so a
+    lock can never be left behind."""
+
+    def __init__(self, name, wait_message=None):
+        self.path = get_state_path(re.sub(r"[^\w.-]", "_", name) + ".lock")
+        self.wait_message = wait_message
+        self._fd = None
+
+    def acquire(self, blocking=True):
+        assert(self._fd is None)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            while not _try_lock(fd):
+                if not blocking:
+                    os.close(fd)
+                    return False
+                if self.wait_message:
+                    sys.stderr.write(self.wait_message + "\n")
+                    self.wait_message = None
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                    break
+                time.sleep(POLL_INTERVAL)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        return True
+
+    def release(self):
+        assert(self._fd is not None)
+        if fcntl:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        os.close(self._fd)
+        self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def _try_lock(fd):
+    try:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
@@ -0,0 +1,112 @@
+import atexit
+from contextlib import contextmanager
+import json
+import math
+import os
+import time
+
+from aws_jumpcloud.lock import FileLock
+from aws_jumpcloud.state import get_state_path, write_atomically
+
+# Each command appends timing and outcome records (never credentials) to a
+# local file, which "aws-jumpcloud stats" summarizes. Set this environment
+# variable to "0" to turn recording off.
+METRICS_ENV_VAR = "AWS_JUMPCLOUD_METRICS"
+METRICS_FILENAME = "metrics.jsonl"
+METRICS_LOCK_NAME = "metrics"
+
+# The file works as a ring buffer: once it holds more than MAX_RECORDS
+# records, the oldest are dropped so that it holds MAX_RECORDS / 2.
+MAX_RECORDS = 20000
+
+# Records are buffered in memory and written once, when the process exits.
+_records = []
+_command = None
+
+
+def set_command(command):
+    global _command
+    _command = command
+
+
+def record(phase, profile=None, duration=None, ok=True, profiles=None):
+    """Records that something happened. Durations are in seconds. Something
+    done on behalf of several profiles at once (e.g. a JumpCloud login)
+    lists them in `profiles` instead of naming one `profile`."""
+    if os.environ.get(METRICS_ENV_VAR) == "0":
+        return
+    if not _records:
+        atexit.register(flush)
+    r = {"ts": round(time.time(), 3), "command": _command, "phase": phase, "ok": ok}
+    if profile is not None:
+        r["profile"] = profile
+    if profiles:
+        r["profiles"] = sorted(profiles)
+    if duration is not None:
+        r["ms"] = round(duration * 1000, 1)
+    _records.append(r)
+
+
+@contextmanager
+def timed(phase, profile=None, profiles=None):
+    """Records how long the body of the `with` statement takes, and whether
+    it raised an exception (including SystemExit with a non-zero code)."""
+    start = time.monotonic()
+    ok = False
+    try:
+        yield
+        ok = True
+    except SystemExit as e:
+        ok = not e.code
+        raise
+    finally:
+        record(phase, profile, time.monotonic() - start, ok, profiles)
+
+
+def flush():
+    global _records
+    if not _records:
+        return
+    lines = "".join([json.dumps(r, separators=(",", ":")) + "\n" for r in _records])
+    _records = []
+    path = get_state_path(METRICS_FILENAME)
+    try:
+        with FileLock(METRICS_LOCK_NAME):
+            with open(path, "a") as f:
+                f.write(lines)
+            _trim(path)
+    except OSError:
+        pass  # metrics are best-effort; never fail a command because of them
+
+
+def read_records(since=None):
+    """Returns all stored records, oldest first, optionally only those
+    recorded at or after the given Unix timestamp."""
+    try:
+        with open(get_state_path(METRICS_FILENAME), "r") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+    if since is not None:
+        records = [r for r in records if r["ts"] >= since]
+    return records
+
+
+def is_for_profile(r, profile):
+    return r.get("profile") == profile or profile in r.get("profiles", [])
+
+
+def percentile(values, p):
+    # Nearest-rank percentile of a non-empty list
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def _trim(path):
+    # Cheap size check first, so that we only count lines occasionally
+    if os.path.getsize(path) < MAX_RECORDS * 80:
+        return
+    with open(path, "r") as f:
+        lines = f.readlines()
+    if len(lines) > MAX_RECORDS:
+        write_atomically(path, "".join(lines[-(MAX_RECORDS // 2):]))
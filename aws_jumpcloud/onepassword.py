@@ -3,9 +3,16 @@ import sys
 import os
 import subprocess
 import json
+import threading
 
 ITEM = "jumpcloud"
 
+# Every field comes from the same item, and "op get item" is slow, so it only
+# runs once per process, however many threads look fields up at once. (TOTP
+# codes change, so those are fetched each time.)
+_item_lock = threading.Lock()
+_items = {}
+
 
 def installed():
     hasop = which("op") is not None and which("op") is not True
@@ -40,12 +47,11 @@ def _get_field(field):
 
 
 def _get_item():
-    raw = _cmd(f"get item {ITEM}")
-
-    if raw:
-        return json.loads(raw)
-    else:
-        return None
+    with _item_lock:
+        if ITEM not in _items:
+            raw = _cmd(f"get item {ITEM}")
+            _items[ITEM] = json.loads(raw) if raw else None
+        return _items[ITEM]
 
 
 def get_totp():
@@ -1,16 +1,32 @@
 import json
 
 from aws_jumpcloud.aws import build_arn, parse_arn
+from aws_jumpcloud.identity import DEFAULT_IDENTITY
 
 
 class Profile(object):
-    def __init__(self, name, jumpcloud_url, role_to_assume=None):
+    __slots__ = ["name", "jumpcloud_url", "aws_account_id", "aws_role", "aws_account_alias",
+                 "role_to_assume", "sts_region", "session_duration", "max_session_duration", "identity"]
+
+    def __init__(self, name, jumpcloud_url, role_to_assume=None, sts_region=None, session_duration=None,
+                 identity=None):
         self.name = name
         self.jumpcloud_url = jumpcloud_url
         self.aws_account_id = None
         self.aws_role = None
         self.aws_account_alias = None
         self.role_to_assume = role_to_assume
+        self.sts_region = sts_region
+        # Either a number of seconds or "max". The longest duration that the
+        # role has accepted so far, when using "max", is saved alongside.
+        self.session_duration = session_duration
+        self.max_session_duration = None
+        # The JumpCloud identity to log in as; None means the default identity
+        self.identity = identity
+
+    @property
+    def identity_name(self):
+        return self.identity or DEFAULT_IDENTITY
 
     @property
     def role_arn(self):
@@ -18,31 +34,49 @@ class Profile(object):
         assert(self.aws_role is not None)
         return build_arn(self.aws_account_id, self.aws_role)
 
-    def dumps(self):
-        return json.dumps({"name": self.name,
-                           "jumpcloud_url": self.jumpcloud_url,
-                           "aws_account_id": self.aws_account_id,
-                           "aws_account_alias": self.aws_account_alias,
-                           "aws_role": self.aws_role,
-                           "role_to_assume": self.role_to_assume.dumps() if self.role_to_assume else None})
+    def to_dict(self):
+        return {"name": self.name,
+                "jumpcloud_url": self.jumpcloud_url,
+                "aws_account_id": self.aws_account_id,
+                "aws_account_alias": self.aws_account_alias,
+                "aws_role": self.aws_role,
+                "role_to_assume": self.role_to_assume.to_dict() if self.role_to_assume else None,
+                "sts_region": self.sts_region,
+                "session_duration": self.session_duration,
+                "max_session_duration": self.max_session_duration,
+                "identity": self.identity}
 
     @classmethod
-    def loads(cls, json_string):
-        data = json.loads(json_string)
-        p = Profile(name=data['name'], jumpcloud_url=data['jumpcloud_url'])
+    def from_dict(cls, data):
+        p = Profile(name=data['name'], jumpcloud_url=data['jumpcloud_url'],
+                    sts_region=data.get('sts_region'), session_duration=data.get('session_duration'),
+                    identity=data.get('identity'))
         p.aws_account_id = data['aws_account_id']
         p.aws_role = data['aws_role']
         p.aws_account_alias = data['aws_account_alias']
+        p.max_session_duration = data.get('max_session_duration')
         if data.get('role_to_assume') is not None:
-            p.role_to_assume = AssumedRole.loads(data['role_to_assume'])
+            p.role_to_assume = AssumedRole.from_dict(data['role_to_assume'])
         return p
 
+    @classmethod
+    def loads(cls, json_string):
+        # Reads a profile stored as a JSON string, as in keyring schema 1,
+        # where the assumed role was a JSON string nested inside that.
+        data = json.loads(json_string)
+        if data.get('role_to_assume') is not None:
+            data['role_to_assume'] = json.loads(data['role_to_assume'])
+        return Profile.from_dict(data)
+
 
 class AssumedRole(object):
+    __slots__ = ["aws_account_id", "aws_role", "external_id", "max_session_duration"]
+
     def __init__(self, aws_account_id, aws_role, external_id):
         self.aws_account_id = aws_account_id
         self.aws_role = aws_role
         self.external_id = external_id
+        self.max_session_duration = None
 
     @property
     def arn(self):
@@ -51,12 +85,16 @@ class AssumedRole(object):
         else:
             return None
 
-    def dumps(self):
-        return json.dumps({"aws_account_id": self.aws_account_id,
-                           "aws_role": self.aws_role,
-                           "external_id": self.external_id})
+    def to_dict(self):
+        return {"aws_account_id": self.aws_account_id,
+                "aws_role": self.aws_role,
+                "external_id": self.external_id,
+                "max_session_duration": self.max_session_duration}
 
     @classmethod
-    def loads(cls, json_string):
-        data = json.loads(json_string)
-        return AssumedRole(**data)
+    def from_dict(cls, data):
+        r = AssumedRole(aws_account_id=data['aws_account_id'],
+                        aws_role=data['aws_role'],
+                        external_id=data['external_id'])
+        r.max_session_duration = data.get('max_session_duration')
+        return r
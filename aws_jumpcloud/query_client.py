@@ -0,0 +1,139 @@
+from datetime import datetime, timezone
+import http.client
+import os
+import re
+import ssl
+import threading
+from urllib.parse import urlencode, urlparse
+import xml.etree.ElementTree as ElementTree
+
+from aws_jumpcloud.sigv4 import sign_headers
+
+# A minimal client for the AWS Query APIs that logging in needs (STS
+# AssumeRoleWithSAML and AssumeRole, and IAM ListAccountAliases), built on
+# the standard library. Importing boto3 and loading its service models takes
+# longer, and uses more memory, than the requests themselves.
+#
+# Connections are kept open and reused for later requests to the same host,
+# e.g. when logging in to many profiles at once.
+API_VERSIONS = {"sts": "2011-06-15", "iam": "2010-05-08"}
+CONTENT_TYPE = "application/x-www-form-urlencoded; charset=utf-8"
+DEFAULT_TIMEOUT = 60  # in seconds
+USER_AGENT = "aws-jumpcloud"
+
+TIMESTAMP_REGEXP = re.compile(r"^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(\.\d+)?(Z|[+-]00:?00)?$")
+
+
+class AWSRequestError(Exception):
+    """An error response from an AWS API, e.g. AccessDenied or Throttling."""
+
+    def __init__(self, code, message, status):
+        Exception.__init__(self, f"{code}: {message}" if message else code)
+        self.code = code
+        self.message = message
+        self.status = status
+
+
+class AWSConnectionError(Exception):
+    """The request couldn't be sent, or no response was received."""
+
+
+class QueryClient(object):
+    def __init__(self, service, region, endpoint_url, session=None, timeout=DEFAULT_TIMEOUT):
+        """`session` is the AWSSession to sign requests with, or None to send
+        them unsigned (as for STS AssumeRoleWithSAML)."""
+        self.service = service
+        self.region = region
+        self.endpoint_url = endpoint_url
+        self.session = session
+        self.timeout = timeout
+
+    def call(self, action, params):
+        """Makes an API request, and returns the <{action}Result> element of
+        the response, with XML namespaces removed from the tag names."""
+        body = urlencode(dict(params, Action=action, Version=API_VERSIONS[self.service])).encode("utf-8")
+        headers = {"Content-Type": CONTENT_TYPE}
+        if self.session:
+            headers = sign_headers(self.endpoint_url, self.region, self.service, self.session, body,
+                                   headers)
+        (status, data) = _post(self.endpoint_url, body, headers, self.timeout)
+        root = _parse_xml(data, status)
+        error = root.find("Error") if root.tag == "ErrorResponse" else root if root.tag == "Error" else None
+        if error is not None or status != 200:
+            code = error.findtext("Code") if error is not None else None
+            message = error.findtext("Message") if error is not None else None
+            raise AWSRequestError(code or f"HTTP{status}", message, status)
+        result = root.find(f"{action}Result")
+        if result is None:
+            raise AWSRequestError("InvalidResponse", f"no {action}Result in the response", status)
+        return result
+
+
+def parse_timestamp(value):
+    # Returns a timezone-aware datetime for an ISO 8601 timestamp in UTC, as
+    # used in AWS responses (e.g. "2018-11-15T20:49:38Z")
+    m = TIMESTAMP_REGEXP.match(value.strip())
+    if not m:
+        raise ValueError(f"unexpected timestamp {value!r}")
+    return datetime.strptime(m.group(1), "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc)
+
+
+def _parse_xml(data, status):
+    try:
+        root = ElementTree.fromstring(data)
+    except ElementTree.ParseError:
+        raise AWSRequestError(f"HTTP{status}", "the response wasn't XML", status) from None
+    for element in root.iter():
+        element.tag = element.tag.split("}", 1)[-1]
+    return root
+
+
+# Connection pool: idle connections, by (scheme, host, port)
+_idle_connections = {}
+_pool_lock = threading.Lock()
+
+
+def _post(url, body, headers, timeout):
+    parsed = urlparse(url)
+    key = (parsed.scheme, parsed.hostname, parsed.port)
+    path = parsed.path or "/"
+    headers = dict(headers, **{"User-Agent": USER_AGENT})
+    # A pooled connection may have been closed by the server since it was
+    # last used, so a failure on one is retried once on a new connection
+    while True:
+        (connection, reused) = _get_connection(key, timeout)
+        try:
+            connection.request("POST", path, body=body, headers=headers)
+            response = connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            if reused:
+                continue
+            raise AWSConnectionError(f"Couldn't connect to {parsed.netloc}: {e}") from e
+        if response.will_close:
+            connection.close()
+        else:
+            _return_connection(key, connection)
+        return (response.status, data)
+
+
+def _get_connection(key, timeout):
+    with _pool_lock:
+        idle = _idle_connections.get(key)
+        if idle:
+            connection = idle.pop()
+            connection.timeout = timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(timeout)
+            return (connection, True)
+    (scheme, host, port) = key
+    if scheme == "https":
+        context = ssl.create_default_context(cafile=os.environ.get("AWS_CA_BUNDLE") or None)
+        return (http.client.HTTPSConnection(host, port, timeout=timeout, context=context), False)
+    return (http.client.HTTPConnection(host, port, timeout=timeout), False)
+
+
+def _return_connection(key, connection):
+    with _pool_lock:
+        _idle_connections.setdefault(key, []).append(connection)
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta, timezone
+import os
+import re
+import subprocess
+import sys
+import time
+
+import aws_jumpcloud.metrics as metrics
+from aws_jumpcloud.state import get_state_path
+
+# Stale-while-revalidate. An AWS session is due to be replaced REFRESH_AHEAD
+# before it expires; from then on it's "stale". For up to the max staleness
+# after that, it's still served straight away, while a background process
+# logs in to the profile again, so commands don't wait on JumpCloud and STS.
+# A staler session makes the command log in itself, and is only served if
+# that fails.
+REFRESH_AHEAD = timedelta(minutes=15)
+MAX_STALENESS_ENV_VAR = "AWS_JUMPCLOUD_MAX_STALENESS"
+DEFAULT_MAX_STALENESS = timedelta(minutes=10)
+
+# Each profile's background login is started at most this often, however
+# many commands find its session stale. A background process logs in to all
+# of the stale profiles it's given (those of one JumpCloud identity) with a
+# single JumpCloud login, up to JOBS of them at once.
+START_INTERVAL = 30  # in seconds
+STAMP_FILENAME = "revalidate-{profile}.stamp"
+JOBS = 8
+
+
+def get_staleness(session, now=None):
+    """Returns how long the session has been stale, as a timedelta, which is
+    negative if it's still fresh."""
+    return (now or datetime.now(timezone.utc)) - (session.expires_at - REFRESH_AHEAD)
+
+
+def start(profile_names):
+    """Starts one detached aws-jumpcloud process that logs in to the profiles
+    again, which should all use the same JumpCloud identity. Profiles for
+    which one was started recently are left out."""
+    profile_names = [name for name in profile_names if _stamp(name)]
+    if not profile_names:
+        return
+    if os.name == "posix":
+        kwargs = {"start_new_session": True}
+    else:
+        kwargs = {"creationflags": subprocess.DETACHED_PROCESS}
+    subprocess.Popen([sys.executable, "-m", "aws_jumpcloud.revalidate"] + profile_names,
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     close_fds=True, **kwargs)
+    for name in profile_names:
+        metrics.record("revalidate_started", name)
+
+
+def _stamp(profile_name):
+    # Returns False if the profile's background login was started too
+    # recently to start another; otherwise records that one is starting now
+    stamp_path = get_state_path(STAMP_FILENAME.format(profile=re.sub(r"[^\w.-]", "_", profile_name)))
+    try:
+        if time.time() - os.path.getmtime(stamp_path) < START_INTERVAL:
+            return False
+    except FileNotFoundError:
+        pass
+    with open(stamp_path, "w"):
+        pass
+    return True
+
+
+def main():
+    # The background process started by start(). Its output goes nowhere, and
+    # it never prompts, so a login that needs an MFA code without a stored
+    # seed simply fails, and the next command logs in instead.
+    from aws_jumpcloud import commands
+    metrics.set_command("revalidate")
+    with metrics.timed("command:revalidate"):
+        commands._revalidate_sessions(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    main()
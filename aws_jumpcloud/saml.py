@@ -1,9 +1,15 @@
 from collections import namedtuple
+from datetime import datetime, timezone
+import re
 
 from bs4 import BeautifulSoup  # pylint: disable=E0401
 
 SAMLRole = namedtuple("SAMLRole", ["role_arn", "principal_arn"])
 
+# SAML timestamps are UTC, e.g. "2018-11-15T20:49:38Z" or with fractional
+# seconds, "2018-11-15T20:49:38.123Z".
+TIMESTAMP_REGEXP = re.compile(r"^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(\.\d+)?Z?$")
+
 
 def get_assertion_roles(saml_assertion_xml):
     # Returns a list of AWS roles that the assertion says may be assumed.
@@ -38,3 +44,18 @@ def get_assertion_duration(saml_assertion_xml):
         value_tag = attr_tag.find("AttributeValue")
         assert(value_tag is not None)
         return int(value_tag.text)
+
+
+def get_assertion_expiry(saml_assertion_xml):
+    # Returns the earliest NotOnOrAfter time in the assertion (its conditions
+    # and subject confirmations), as a timezone-aware datetime, or None if
+    # the assertion doesn't say when it expires.
+    soup = BeautifulSoup(saml_assertion_xml, "lxml-xml")
+    assertion_tag = soup.find("Assertion")
+    assert(assertion_tag is not None)
+    expiries = []
+    for tag in assertion_tag.find_all(attrs={"NotOnOrAfter": True}):
+        m = TIMESTAMP_REGEXP.match(tag.attrs["NotOnOrAfter"].strip())
+        if m:
+            expiries.append(datetime.strptime(m.group(1), "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc))
+    return min(expiries) if expiries else None
@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta, timezone
+import os
+
+from aws_jumpcloud.saml import get_assertion_expiry
+
+# A SAML assertion from JumpCloud can be presented to STS until its
+# NotOnOrAfter time, usually a few minutes after it was issued. Caching it by
+# SSO URL and JumpCloud identity lets a retry, or another profile with the
+# same SSO URL and identity, log in to AWS without another round-trip to
+# JumpCloud (and without an MFA prompt).
+#
+# Assertions are always cached in memory for the life of the process. Set
+# this environment variable to "keyring" to also cache them in the OS
+# keychain, so that other aws-jumpcloud processes (e.g. running "rotate"
+# again straight away) can use them too.
+SAML_CACHE_ENV_VAR = "AWS_JUMPCLOUD_SAML_CACHE"
+KEYRING_CACHE = "keyring"
+
+# Assertions are not used once they're this close to expiring, to allow for
+# clock skew and for the time the STS request takes.
+EXPIRY_MARGIN = timedelta(minutes=1)
+
+_assertions = {}
+
+
+def get(keyring, profile):
+    """Returns a cached, unexpired SAML assertion for the profile's SSO URL
+    and identity, or None."""
+    key = (profile.identity_name, profile.jumpcloud_url)
+    cached = _assertions.get(key)
+    if cached is None and _use_keyring():
+        cached = keyring.get_saml_assertion(profile.jumpcloud_url, identity=profile.identity_name)
+    if cached is None:
+        return None
+    (saml_assertion_xml, expires_at) = cached
+    if expires_at - EXPIRY_MARGIN < datetime.now(timezone.utc):
+        return None
+    _assertions[key] = cached
+    return saml_assertion_xml
+
+
+def store(keyring, profile, saml_assertion_xml):
+    # Assertions that don't say when they expire aren't cached
+    expires_at = get_assertion_expiry(saml_assertion_xml)
+    if expires_at is None or expires_at - EXPIRY_MARGIN < datetime.now(timezone.utc):
+        return
+    _assertions[(profile.identity_name, profile.jumpcloud_url)] = (saml_assertion_xml, expires_at)
+    if _use_keyring():
+        keyring.store_saml_assertion(profile.jumpcloud_url, saml_assertion_xml, expires_at,
+                                     identity=profile.identity_name)
+
+
+def discard(keyring, profile):
+    _assertions.pop((profile.identity_name, profile.jumpcloud_url), None)
+    if _use_keyring():
+        keyring.delete_saml_assertion(profile.jumpcloud_url, identity=profile.identity_name)
+
+
+def _use_keyring():
+    return os.environ.get(SAML_CACHE_ENV_VAR) == KEYRING_CACHE
@@ -0,0 +1,152 @@
+import random
+import threading
+import time
+
+import aws_jumpcloud.metrics as metrics
+from aws_jumpcloud.query_client import AWSRequestError
+
+# Every STS and IAM request goes through a token bucket for its endpoint, so
+# that bulk operations (e.g. "rotate --all" or "exec --all" with hundreds of
+# profiles) stay under AWS's request rate limits instead of failing. The
+# limits are requests per second; each bucket holds up to one second's worth
+# of requests, so short bursts aren't delayed at all.
+DEFAULT_RATE_LIMITS = {"sts": 50.0, "iam": 10.0}
+
+# Error codes that AWS uses to say "slow down". On one of these, the endpoint's
+# rate is halved and the request is retried with exponential backoff and
+# jitter; each success raises the rate again a little, back up to its limit.
+THROTTLING_ERROR_CODES = ["Throttling", "ThrottlingException", "RequestLimitExceeded",
+                          "TooManyRequestsException"]
+
+# Server errors (HTTP 5xx, e.g. InternalFailure or ServiceUnavailable) are
+# retried with the same backoff, but without slowing the endpoint's rate, and
+# only a few times: unlike throttling, they usually mean an outage, which the
+# circuit breaker should hear about soon. boto3 used to retry these itself;
+# the built-in client leaves it to us.
+MAX_ATTEMPTS = 12
+MAX_SERVER_ERROR_ATTEMPTS = 3
+MIN_RATE = 0.5  # requests per second
+BACKOFF_BASE = 0.5  # in seconds
+BACKOFF_MAX = 20  # in seconds
+
+
+class TokenBucket(object):
+    def __init__(self, rate):
+        self.max_rate = rate
+        self.rate = rate
+        self._tokens = rate
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Waits until a request may be made. Returns how long it waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._capacity(), self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def slow_down(self):
+        with self._lock:
+            self.rate = max(MIN_RATE, self.rate / 2)
+            self._tokens = min(self._tokens, self._capacity())
+
+    def _capacity(self):
+        # At least one request, or a rate below one per second would never
+        # accumulate enough tokens for any request
+        return max(1.0, self.rate)
+
+    def speed_up(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class Scheduler(object):
+    def __init__(self, rate_limits=None):
+        self._rate_limits = rate_limits or DEFAULT_RATE_LIMITS
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.throttles = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+
+    def call(self, service, endpoint, func):
+        """Calls func() once the endpoint's rate limit allows, retrying it if
+        AWS throttles the request or has a server error. `service` is "sts"
+        or "iam", and `endpoint` identifies the endpoint (e.g. its URL) within
+        it."""
+        bucket = self._get_bucket(service, endpoint)
+        server_errors = 0
+        for attempt in range(MAX_ATTEMPTS):
+            self._enqueue(+1)
+            try:
+                waited = bucket.acquire()
+            finally:
+                self._enqueue(-1)
+            if waited > 0:
+                metrics.record("rate_limit_wait", duration=waited)
+            try:
+                result = func()
+            except AWSRequestError as e:
+                if attempt == MAX_ATTEMPTS - 1:
+                    raise
+                if is_throttling_error(e):
+                    with self._lock:
+                        self.throttles += 1
+                    metrics.record(f"{service}_throttled", ok=False)
+                    bucket.slow_down()
+                elif is_server_error(e):
+                    server_errors += 1
+                    if server_errors == MAX_SERVER_ERROR_ATTEMPTS:
+                        raise
+                else:
+                    raise
+                time.sleep(min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.5))
+                continue
+            bucket.speed_up()
+            return result
+
+    def get_summary(self):
+        """Returns a one-line description of how busy the scheduler has been,
+        or None if nothing was delayed."""
+        if self.throttles == 0 and self.max_queue_depth <= 1:
+            return None
+        return (f"{self.requests} AWS request(s); {self.throttles} throttled and retried; "
+                f"up to {self.max_queue_depth} waiting at once.")
+
+    def _get_bucket(self, service, endpoint):
+        with self._lock:
+            self.requests += 1
+            key = (service, endpoint)
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(self._rate_limits[service])
+            return self._buckets[key]
+
+    def _enqueue(self, delta):
+        with self._lock:
+            self.queue_depth += delta
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+
+def is_throttling_error(error):
+    return error.code in THROTTLING_ERROR_CODES
+
+
+def is_server_error(error):
+    return error.status is not None and error.status >= 500
+
+
+# The scheduler shared by every request this process makes
+_scheduler = Scheduler()
+
+
+def get_scheduler():
+    return _scheduler
@@ -0,0 +1,53 @@
+from datetime import datetime, timezone
+import json
+import os
+
+from aws_jumpcloud.state import get_state_path, write_atomically
+
+# A small, non-secret file that maps each profile name to the time its AWS
+# session expires. The Keyring class rewrites it whenever sessions change, so
+# that "aws-jumpcloud is-active" (which runs on every shell prompt) can answer
+# without decrypting the keychain or importing boto3.
+INDEX_FILENAME = "sessions.json"
+
+
+def get_index_path():
+    return get_state_path(INDEX_FILENAME)
+
+
+def read_expirations():
+    """Returns a dict of profile name to session expiration (a timezone-aware
+    datetime), or None if the index hasn't been written yet."""
+    try:
+        with open(get_index_path(), "r") as f:
+            data = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    return dict([(name, datetime.fromtimestamp(ts, tz=timezone.utc)) for (name, ts) in data.items()])
+
+
+def write_expirations(sessions):
+    """Rewrites the index from a dict of profile name to AWSSession."""
+    data = dict([(name, session.expires_at.timestamp()) for (name, session) in sessions.items()])
+    write_atomically(get_index_path(), json.dumps(data, sort_keys=True))
+
+
+def index_exists():
+    return os.path.exists(get_index_path())
+
+
+def delete_index():
+    try:
+        os.unlink(get_index_path())
+    except FileNotFoundError:
+        pass
+
+
+def is_active(profile_name):
+    """Returns True if the index says the profile has an unexpired session,
+    False if it doesn't, or None if the index hasn't been written yet."""
+    expirations = read_expirations()
+    if expirations is None:
+        return None
+    expires_at = expirations.get(profile_name)
+    return expires_at is not None and expires_at > datetime.now(timezone.utc)
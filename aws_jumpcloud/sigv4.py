@@ -0,0 +1,96 @@
+from datetime import datetime, timezone
+import hashlib
+import hmac
+from urllib.parse import parse_qsl, quote, urlparse
+
+# AWS Signature Version 4, as documented at
+# https://docs.aws.amazon.com/general/latest/gr/signature-version-4.html.
+# Implemented with the standard library only, so that the code paths that
+# use it don't have to import botocore.
+ALGORITHM = "AWS4-HMAC-SHA256"
+EMPTY_PAYLOAD_HASH = "e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855"
+
+
+def presign_url(url, region, service, session, expires_in, headers=None, method="GET", now=None):
+    """Returns the URL with a SigV4 signature in its query string, signed with
+    the given AWSSession's credentials. Any headers given here are signed too,
+    and must be sent with the request."""
+    now = now or datetime.now(timezone.utc)
+    parsed = urlparse(url)
+    headers = _normalize_headers(parsed.netloc, headers)
+    (amz_date, scope) = _get_date_and_scope(now, region, service)
+    query = parse_qsl(parsed.query, keep_blank_values=True) + [
+        ("X-Amz-Algorithm", ALGORITHM),
+        ("X-Amz-Credential", f"{session.access_key_id}/{scope}"),
+        ("X-Amz-Date", amz_date),
+        ("X-Amz-Expires", str(expires_in)),
+        ("X-Amz-SignedHeaders", ";".join(sorted(headers.keys())))]
+    if session.session_token:
+        query.append(("X-Amz-Security-Token", session.session_token))
+    canonical_query = _canonical_query(query)
+    canonical_request = _canonical_request(method, parsed.path, canonical_query, headers,
+                                           EMPTY_PAYLOAD_HASH)
+    signature = _sign(session.secret_access_key, region, service, amz_date, scope, canonical_request)
+    path = parsed.path or "/"
+    return f"{parsed.scheme}://{parsed.netloc}{path}?{canonical_query}&X-Amz-Signature={signature}"
+
+
+def sign_headers(url, region, service, session, body, headers=None, method="POST", now=None):
+    """Returns the headers to send with a request so that it's signed with the
+    given AWSSession's credentials: the given headers, plus Host, X-Amz-Date,
+    X-Amz-Security-Token (for temporary credentials) and Authorization."""
+    now = now or datetime.now(timezone.utc)
+    parsed = urlparse(url)
+    (amz_date, scope) = _get_date_and_scope(now, region, service)
+    signed = dict(headers or {}, **{"X-Amz-Date": amz_date})
+    if session.session_token:
+        signed["X-Amz-Security-Token"] = session.session_token
+    normalized = _normalize_headers(parsed.netloc, signed)
+    canonical_query = _canonical_query(parse_qsl(parsed.query, keep_blank_values=True))
+    canonical_request = _canonical_request(method, parsed.path, canonical_query, normalized,
+                                           _sha256_hex(body))
+    signature = _sign(session.secret_access_key, region, service, amz_date, scope, canonical_request)
+    signed["Host"] = parsed.netloc
+    signed_headers = ";".join(sorted(normalized.keys()))
+    signed["Authorization"] = (f"{ALGORITHM} Credential={session.access_key_id}/{scope}, "
+                               f"SignedHeaders={signed_headers}, Signature={signature}")
+    return signed
+
+
+def _normalize_headers(host, headers):
+    normalized = {"host": host}
+    for (name, value) in (headers or {}).items():
+        normalized[name.lower()] = " ".join(str(value).split())
+    return normalized
+
+
+def _get_date_and_scope(now, region, service):
+    amz_date = now.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    return (amz_date, f"{amz_date[:8]}/{region}/{service}/aws4_request")
+
+
+def _canonical_query(params):
+    return "&".join([f"{_uri_encode(k)}={_uri_encode(v)}" for (k, v) in sorted(params)])
+
+
+def _canonical_request(method, path, canonical_query, headers, payload_hash):
+    canonical_headers = "".join([f"{name}:{headers[name]}\n" for name in sorted(headers.keys())])
+    signed_headers = ";".join(sorted(headers.keys()))
+    return "\n".join([method, quote(path or "/", safe="/-_.~"), canonical_query,
+                      canonical_headers, signed_headers, payload_hash])
+
+
+def _sign(secret_access_key, region, service, amz_date, scope, canonical_request):
+    string_to_sign = "\n".join([ALGORITHM, amz_date, scope, _sha256_hex(canonical_request.encode("utf-8"))])
+    key = ("AWS4" + secret_access_key).encode("utf-8")
+    for part in [amz_date[:8], region, service, "aws4_request"]:
+        key = hmac.new(key, part.encode("utf-8"), hashlib.sha256).digest()
+    return hmac.new(key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def _sha256_hex(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _uri_encode(value):
+    return quote(value, safe="-_.~")
@@ -0,0 +1,36 @@
+import os
+import tempfile
+
+# Local state (session expiry index, lock files, caches) lives here, outside
+# the OS keychain, so that it can be read quickly. Files are only readable by
+# the current user, but long-lived secrets still belong in the keychain.
+DEFAULT_STATE_DIR = os.path.join("~", ".aws-jumpcloud")
+
+
+def get_state_dir():
+    path = os.path.expanduser(os.environ.get("AWS_JUMPCLOUD_STATE_DIR") or DEFAULT_STATE_DIR)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
+
+
+def get_state_path(filename):
+    return os.path.join(get_state_dir(), filename)
+
+
+def write_atomically(path, text):
+    """Replaces the file at `path` with the given text, by writing a temporary
+    file in the same directory and renaming it into place. Readers see either
+    the old contents or the new contents, never a partial write."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".aws-jumpcloud-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
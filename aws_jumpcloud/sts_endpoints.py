@@ -0,0 +1,124 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import re
+import socket
+import time
+from urllib.parse import urlparse
+
+from aws_jumpcloud.state import get_state_path, write_atomically
+
+# An STS endpoint to send requests to. A url of None means the default: the
+# global endpoint, unless AWS_ENDPOINT_URL_STS or AWS_ENDPOINT_URL says
+# otherwise, which is how aws-jumpcloud behaved before regional endpoints were
+# configurable.
+STSEndpoint = namedtuple("STSEndpoint", ["region", "url"])
+DEFAULT_ENDPOINT = STSEndpoint(None, None)
+GLOBAL_ENDPOINT = STSEndpoint("us-east-1", "https://sts.amazonaws.com")
+
+# The region setting (per profile, or globally via this environment variable)
+# is either a region name or "auto", which probes the candidate regions and
+# uses the fastest one that responds.
+REGION_ENV_VAR = "AWS_JUMPCLOUD_STS_REGION"
+AUTO = "auto"
+
+# Candidate regions for "auto", overridable with a comma-separated list.
+CANDIDATE_REGIONS_ENV_VAR = "AWS_JUMPCLOUD_STS_REGIONS"
+DEFAULT_CANDIDATE_REGIONS = ["us-east-1", "us-east-2", "us-west-1", "us-west-2", "ca-central-1",
+                             "eu-west-1", "eu-central-1", "ap-southeast-1", "ap-southeast-2",
+                             "ap-northeast-1", "ap-south-1", "sa-east-1"]
+
+# A comma-separated list of endpoint URLs that replaces the candidates
+# entirely, e.g. for VPC endpoints or local stand-ins during testing.
+ENDPOINTS_ENV_VAR = "AWS_JUMPCLOUD_STS_ENDPOINTS"
+
+# Probe results are cached in the state directory and reused for this long.
+PROBE_CACHE_FILENAME = "sts-endpoints.json"
+PROBE_TTL = 24 * 60 * 60  # in seconds
+PROBE_TIMEOUT = 2  # in seconds
+
+REGIONAL_HOST_REGEXP = re.compile(r"^sts\.([a-z0-9-]+)\.amazonaws\.com$")
+
+
+def get_sts_endpoints(region_setting=None):
+    """Returns the STS endpoints to try, most preferred first, for a
+    profile's region setting (falling back to the global setting)."""
+    region_setting = region_setting or os.environ.get(REGION_ENV_VAR)
+    if os.environ.get(ENDPOINTS_ENV_VAR):
+        candidates = [_endpoint_from_url(u.strip()) for u in os.environ[ENDPOINTS_ENV_VAR].split(",")]
+        return _rank_endpoints(candidates) if region_setting == AUTO else candidates
+    if not region_setting:
+        return [DEFAULT_ENDPOINT]
+    if region_setting == AUTO:
+        return _rank_endpoints([_regional_endpoint(r) for r in _get_candidate_regions()])
+    # Fall back to the global endpoint if the chosen region is unreachable
+    return [_regional_endpoint(region_setting), GLOBAL_ENDPOINT]
+
+
+def report_failure(endpoint):
+    """Moves an endpoint that failed to the back of the cached ranking, so
+    that the next process doesn't try it first."""
+    cache = _read_probe_cache()
+    if not cache or endpoint.url not in [url for (_, url, _) in cache["ranking"]]:
+        return
+    ranking = [r for r in cache["ranking"] if r[1] != endpoint.url]
+    ranking.append([endpoint.region, endpoint.url, None])
+    _write_probe_cache(cache["measured_at"], ranking)
+
+
+def _regional_endpoint(region):
+    return STSEndpoint(region, f"https://sts.{region}.amazonaws.com")
+
+
+def _endpoint_from_url(url):
+    match = REGIONAL_HOST_REGEXP.match(urlparse(url).hostname or "")
+    return STSEndpoint(match.group(1) if match else GLOBAL_ENDPOINT.region, url)
+
+
+def _get_candidate_regions():
+    if os.environ.get(CANDIDATE_REGIONS_ENV_VAR):
+        return [r.strip() for r in os.environ[CANDIDATE_REGIONS_ENV_VAR].split(",")]
+    return DEFAULT_CANDIDATE_REGIONS
+
+
+def _rank_endpoints(candidates):
+    # Returns the candidates sorted by connection latency, using the cached
+    # ranking if it's recent and covers the same candidates.
+    cache = _read_probe_cache()
+    if cache and time.time() - cache["measured_at"] < PROBE_TTL and \
+            sorted([url for (_, url, _) in cache["ranking"]]) == sorted([e.url for e in candidates]):
+        return [STSEndpoint(region, url) for (region, url, _) in cache["ranking"]]
+
+    with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+        latencies = list(executor.map(_probe, candidates))
+    # Unreachable endpoints (latency None) go last, but stay in the list
+    ranking = sorted(zip(candidates, latencies), key=lambda r: (r[1] is None, r[1] or 0))
+    _write_probe_cache(time.time(), [[e.region, e.url, latency] for (e, latency) in ranking])
+    return [e for (e, _) in ranking]
+
+
+def _probe(endpoint):
+    # Measures how long it takes to open a TCP connection to the endpoint,
+    # which is a good proxy for the round-trip time of an STS request.
+    url = urlparse(endpoint.url)
+    port = url.port or (443 if url.scheme == "https" else 80)
+    start = time.monotonic()
+    try:
+        with socket.create_connection((url.hostname, port), timeout=PROBE_TIMEOUT):
+            return time.monotonic() - start
+    except OSError:
+        return None
+
+
+def _read_probe_cache():
+    try:
+        with open(get_state_path(PROBE_CACHE_FILENAME), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_probe_cache(measured_at, ranking):
+    write_atomically(get_state_path(PROBE_CACHE_FILENAME),
+                     json.dumps({"measured_at": measured_at, "ranking": ranking}))
@@ -0,0 +1,89 @@
+import base64
+import hashlib
+import hmac
+import re
+import struct
+import sys
+import time
+from urllib.parse import parse_qs, urlparse
+
+from aws_jumpcloud.lock import FileLock
+from aws_jumpcloud.state import get_state_path, write_atomically
+
+# Time-based one-time passwords (RFC 6238), as used by JumpCloud's MFA: an
+# HMAC-SHA1 of the number of 30-second steps since the Unix epoch, truncated
+# to six digits.
+STEP = 30  # in seconds
+DIGITS = 6
+
+# A code may only be used once, even by different aws-jumpcloud processes,
+# so the last time step whose code was used is recorded in the state
+# directory. (It's only a counter, so it doesn't need to be in the keychain.)
+# Each seed has its own counter and lock, so identities with different seeds
+# don't wait for each other.
+COUNTER_FILENAME = "totp-counter-{seed_id}"
+COUNTER_LOCK_NAME = "totp-{seed_id}"
+
+BASE32_REGEXP = re.compile(r"^[A-Z2-7]+=*$")
+
+
+def parse_seed(value):
+    """Returns the base32 TOTP seed from either the seed itself (as shown
+    when setting up an authenticator app, possibly with spaces) or an
+    otpauth:// URI. Raises ValueError if it isn't valid."""
+    value = value.strip()
+    if value.startswith("otpauth://"):
+        value = parse_qs(urlparse(value).query).get("secret", [""])[0]
+    seed = re.sub(r"[\s-]", "", value).upper().rstrip("=")
+    if not seed or not BASE32_REGEXP.match(seed):
+        raise ValueError("not a base32 TOTP seed or otpauth:// URI")
+    _decode_seed(seed)
+    return seed
+
+
+def generate_code(seed, counter):
+    """Returns the code for the given time step (RFC 4226 HOTP)."""
+    digest = hmac.new(_decode_seed(seed), struct.pack(">Q", counter), hashlib.sha1).digest()
+    offset = digest[-1] & 0x0F
+    value = struct.unpack(">I", digest[offset:offset + 4])[0] & 0x7FFFFFFF
+    return str(value % 10 ** DIGITS).zfill(DIGITS)
+
+
+def get_counter(timestamp=None):
+    return int((time.time() if timestamp is None else timestamp) // STEP)
+
+
+def get_unused_code(seed):
+    """Returns a code that no aws-jumpcloud process has used yet. If the
+    current time step's code has already been used, waits for the next
+    step."""
+    # The lock is only held while reserving a step, not while waiting for it,
+    # so that another process can reserve the step after that meanwhile
+    with FileLock(COUNTER_LOCK_NAME.format(seed_id=_get_seed_id(seed))):
+        counter = max(get_counter(), _read_last_counter(seed) + 1)
+        write_atomically(_get_counter_path(seed), str(counter))
+    delay = counter * STEP - time.time()
+    if delay > 0:
+        sys.stderr.write(f"Waiting {delay:.0f} seconds for a new multi-factor auth code...\n")
+        time.sleep(delay)
+    return generate_code(seed, counter)
+
+
+def _get_seed_id(seed):
+    return hashlib.sha256(seed.encode("ascii")).hexdigest()[:16]
+
+
+def _get_counter_path(seed):
+    return get_state_path(COUNTER_FILENAME.format(seed_id=_get_seed_id(seed)))
+
+
+def _read_last_counter(seed):
+    try:
+        with open(_get_counter_path(seed), "r") as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def _decode_seed(seed):
+    return base64.b32decode(seed + "=" * (-len(seed) % 8))
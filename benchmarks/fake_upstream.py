@@ -0,0 +1,147 @@
+"""A local stand-in for the JumpCloud User Console, JumpCloud's SAML SSO
+endpoint, and the STS and IAM APIs, for benchmarks and stress tests. It
+accepts any credentials and counts the requests it receives.
+
+Point aws-jumpcloud at it with the environment variables returned by
+FakeUpstream.environment(), and use FakeUpstream.sso_url() as the SSO URL of
+each profile.
+"""
+import base64
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+from urllib.parse import parse_qs
+import uuid
+
+AWS_ACCOUNT_ID = "123456789012"
+ROLE_NAME = "JumpCloudDevs"
+
+SAML_ASSERTION = f"""<?xml version="1.0" encoding="UTF-8"?>
+<saml2p:Response xmlns:saml2p="urn:oasis:names:tc:SAML:2.0:protocol">
+  <saml2:Assertion xmlns:saml2="urn:oasis:names:tc:SAML:2.0:assertion">
+    <saml2:Conditions NotBefore="{{not_before}}" NotOnOrAfter="{{not_on_or_after}}"/>
+    <saml2:AttributeStatement>
+      <saml2:Attribute Name="https://aws.amazon.com/SAML/Attributes/Role">
+        <saml2:AttributeValue>arn:aws:iam::{AWS_ACCOUNT_ID}:role/{ROLE_NAME},arn:aws:iam::{AWS_ACCOUNT_ID}:saml-provider/JumpCloud</saml2:AttributeValue>
+      </saml2:Attribute>
+    </saml2:AttributeStatement>
+  </saml2:Assertion>
+</saml2p:Response>"""
+
+STS_CREDENTIALS = """<Credentials>
+      <AccessKeyId>ASIA{key_suffix}</AccessKeyId>
+      <SecretAccessKey>fake-secret-access-key</SecretAccessKey>
+      <SessionToken>fake-session-token-{key_suffix}</SessionToken>
+      <Expiration>{expiration}</Expiration>
+    </Credentials>"""
+
+STS_RESPONSE = """<{action}Response xmlns="https://sts.amazonaws.com/doc/2011-06-15/">
+  <{action}Result>
+    {credentials}
+  </{action}Result>
+  <ResponseMetadata><RequestId>{request_id}</RequestId></ResponseMetadata>
+</{action}Response>"""
+
+IAM_ALIASES_RESPONSE = """<ListAccountAliasesResponse xmlns="https://iam.amazonaws.com/doc/2010-05-08/">
+  <ListAccountAliasesResult>
+    <IsTruncated>false</IsTruncated>
+    <AccountAliases><member>fake-account</member></AccountAliases>
+  </ListAccountAliasesResult>
+  <ResponseMetadata><RequestId>{request_id}</RequestId></ResponseMetadata>
+</ListAccountAliasesResponse>"""
+
+
+class FakeUpstream(object):
+    def __init__(self, latency=0.0):
+        self.latency = latency  # seconds added to every response
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.upstream = self
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def sso_url(self, app_name):
+        return f"{self.url}/saml2/{app_name}"
+
+    def environment(self):
+        return {"AWS_JUMPCLOUD_CONSOLE_URL": self.url,
+                "AWS_JUMPCLOUD_STS_ENDPOINTS": self.url,
+                "AWS_ENDPOINT_URL_IAM": self.url,
+                "AWS_DEFAULT_REGION": "us-east-1"}
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        upstream = self.server.upstream
+        time.sleep(upstream.latency)
+        if self.path == "/userconsole/xsrf":
+            upstream.count("jumpcloud_xsrf")
+            self._respond(200, "application/json", json.dumps({"xsrf": "fake-xsrf-token"}))
+        elif self.path.startswith("/saml2/"):
+            upstream.count("jumpcloud_saml")
+            now = datetime.now(timezone.utc)
+            assertion = SAML_ASSERTION.format(not_before=_iso8601(now),
+                                              not_on_or_after=_iso8601(now + timedelta(minutes=5)))
+            value = base64.b64encode(assertion.encode("utf-8")).decode("ascii")
+            self._respond(200, "text/html", f'<html><body><form method="post"><input type="hidden" '
+                                            f'name="SAMLResponse" value="{value}"/></form></body></html>')
+        else:
+            self._respond(404, "text/plain", "not found")
+
+    def do_POST(self):
+        upstream = self.server.upstream
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8")
+        time.sleep(upstream.latency)
+        if self.path == "/userconsole/auth":
+            upstream.count("jumpcloud_login")
+            self._respond(200, "application/json", "{}")
+            return
+        action = parse_qs(body).get("Action", [""])[0]
+        upstream.count(action)
+        request_id = str(uuid.uuid4())
+        if action in ["AssumeRoleWithSAML", "AssumeRole"]:
+            credentials = STS_CREDENTIALS.format(
+                key_suffix=uuid.uuid4().hex[:16].upper(),
+                expiration=_iso8601(datetime.now(timezone.utc) + timedelta(hours=1)))
+            self._respond(200, "text/xml", STS_RESPONSE.format(action=action, credentials=credentials,
+                                                               request_id=request_id))
+        elif action == "ListAccountAliases":
+            self._respond(200, "text/xml", IAM_ALIASES_RESPONSE.format(request_id=request_id))
+        else:
+            self._respond(400, "text/plain", f"unsupported action {action!r}")
+
+    def _respond(self, status, content_type, text):
+        data = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _iso8601(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
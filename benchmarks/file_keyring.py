@@ -0,0 +1,54 @@
+"""A keyring backend that stores passwords in a JSON file, for benchmarks and
+stress tests. Like an OS keychain, it has no transactions: each write simply
+replaces the stored value, so concurrent read-modify-write cycles can lose
+updates unless the caller serializes them.
+
+Select it in child processes with:
+
+    PYTHONPATH=benchmarks PYTHON_KEYRING_BACKEND=file_keyring.FileKeyring
+    FILE_KEYRING_PATH=/path/to/keyring.json
+"""
+import json
+import os
+import tempfile
+
+from keyring.backend import KeyringBackend
+from keyring.errors import PasswordDeleteError
+
+PATH_ENV_VAR = "FILE_KEYRING_PATH"
+
+
+class FileKeyring(KeyringBackend):
+    priority = 1
+
+    def get_password(self, service, username):
+        return self._read().get(self._key(service, username))
+
+    def set_password(self, service, username, password):
+        data = self._read()
+        data[self._key(service, username)] = password
+        self._write(data)
+
+    def delete_password(self, service, username):
+        data = self._read()
+        if self._key(service, username) not in data:
+            raise PasswordDeleteError(username)
+        del data[self._key(service, username)]
+        self._write(data)
+
+    def _key(self, service, username):
+        return f"{service}/{username}"
+
+    def _read(self):
+        try:
+            with open(os.environ[PATH_ENV_VAR], "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write(self, data):
+        path = os.environ[PATH_ENV_VAR]
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,106 @@
+"""Measures how long the Keyring class takes to load and save its data, and
+how large the stored data is, with 10, 100 and 1000 profiles. Compares the
+current storage schema with schema 1 (JSON strings nested inside JSON).
+"Load" is the time to read and parse the stored data; "Save" is the time to
+serialize it (the keychain write itself depends on the OS).
+
+Uses an in-memory keyring backend and a temporary state directory, so it
+never touches your real OS keychain:
+
+    $ python3 benchmarks/keyring_schema.py
+"""
+from datetime import datetime, timedelta, timezone
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+import keyring
+from keyring.backend import KeyringBackend
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from aws_jumpcloud.aws import AWSSession  # noqa: E402
+from aws_jumpcloud.identity import DEFAULT_IDENTITY, Identity  # noqa: E402
+from aws_jumpcloud.keyring import Keyring  # noqa: E402
+from aws_jumpcloud.profile import AssumedRole, Profile  # noqa: E402
+
+PROFILE_COUNTS = [10, 100, 1000]
+REPEAT = 5
+
+
+class MemoryKeyring(KeyringBackend):
+    priority = 1
+
+    def __init__(self):
+        self.passwords = {}
+
+    def get_password(self, service, username):
+        return self.passwords.get((service, username))
+
+    def set_password(self, service, username, password):
+        self.passwords[(service, username)] = password
+
+    def delete_password(self, service, username):
+        del self.passwords[(service, username)]
+
+
+def main():
+    os.environ["AWS_JUMPCLOUD_STATE_DIR"] = tempfile.mkdtemp()
+    backend = MemoryKeyring()
+    keyring.set_keyring(backend)
+    print(f"{'Profiles':>8}  {'Schema':>6}  {'Size (KB)':>9}  {'Load (ms)':>9}  {'Save (ms)':>9}")
+    for count in PROFILE_COUNTS:
+        profiles, sessions = _build_data(count)
+        blobs = [("1", _legacy_blob(profiles, sessions)), ("3", _current_blob(profiles, sessions))]
+        for (schema, blob) in blobs:
+            backend.set_password("aws-jumpcloud", "credentials", blob)
+            k = Keyring()
+            load_ms = _time_ms(k._load)
+            if schema == "1":
+                save_ms = _time_ms(lambda: _legacy_blob(profiles, sessions))
+            else:
+                save_ms = _time_ms(lambda: k._dumps(k._revision + 1))
+            print(f"{count:>8}  {schema:>6}  {len(blob) / 1024:>9.1f}  {load_ms:>9.2f}  {save_ms:>9.2f}")
+
+
+def _build_data(count):
+    expires_at = datetime.now(timezone.utc) + timedelta(hours=1)
+    profiles, sessions = {}, {}
+    for i in range(count):
+        name = f"profile-{i}"
+        role = AssumedRole("123456789012", "deployer", None) if i % 2 else None
+        p = Profile(name, f"https://sso.jumpcloud.com/saml2/aws-{i}", role)
+        p.aws_account_id = "123456789012"
+        p.aws_role = "JumpCloudDevs"
+        profiles[name] = p
+        sessions[name] = AWSSession("ASIA" + "X" * 16, "s" * 40, "t" * 800, expires_at)
+    return profiles, sessions
+
+
+def _legacy_blob(profiles, sessions):
+    def dumps_profile(p):
+        data = p.to_dict()
+        if data["role_to_assume"]:
+            data["role_to_assume"] = json.dumps(data["role_to_assume"])
+        return json.dumps(data)
+    return json.dumps({"jumpcloud_email": "duffman@duff-beer.com",
+                       "jumpcloud_password": "password",
+                       "jumpcloud_timestamp": None,
+                       "profiles": [dumps_profile(p) for p in profiles.values()],
+                       "aws_sessions": dict([(k, json.dumps(v.to_dict())) for (k, v) in sessions.items()])})
+
+
+def _current_blob(profiles, sessions):
+    k = Keyring()
+    k._identities = {DEFAULT_IDENTITY: Identity(DEFAULT_IDENTITY, "duffman@duff-beer.com", "password")}
+    k._profiles, k._aws_sessions, k._saml_assertions = profiles, sessions, {}
+    return k._dumps(revision=1)
+
+
+def _time_ms(func):
+    return min(timeit.repeat(func, number=1, repeat=REPEAT)) * 1000
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Starts many aws-jumpcloud processes at once, the way a build agent running
+hundreds of jobs would, and reports how the CLI copes: throughput, latency
+percentiles, how many logins and STS requests reached the upstream services,
+and whether any keychain updates were lost.
+
+Each process runs "aws-jumpcloud exec <profile> -- true" against a local fake
+JumpCloud/STS/IAM server (fake_upstream.py), with a file-backed keyring
+(file_keyring.py) and a temporary state directory, so it never touches your
+real OS keychain or any real service:
+
+    $ python3 benchmarks/stress.py --processes=200 --profiles=10
+"""
+from argparse import ArgumentParser
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from fake_upstream import FakeUpstream  # noqa: E402
+
+CLI = "from aws_jumpcloud.cli import main; main()"
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--processes", type=int, default=200, help="number of CLI processes (default: 200)")
+    parser.add_argument("--profiles", type=int, default=10,
+                        help="number of profiles the processes are spread across (default: 10)")
+    parser.add_argument("--upstream-latency", type=float, default=50, metavar="MS",
+                        help="delay added to every fake upstream response (default: 50)")
+    parser.add_argument("--warm", action="store_true",
+                        help="log in to every profile before starting, so processes only read sessions")
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(latency=args.upstream_latency / 1000).start()
+    work_dir = tempfile.mkdtemp(prefix="aws-jumpcloud-stress-")
+    env = dict(os.environ, **upstream.environment())
+    env.update({"PYTHONPATH": os.pathsep.join([REPO_DIR, BENCHMARKS_DIR]),
+                "PYTHON_KEYRING_BACKEND": "file_keyring.FileKeyring",
+                "FILE_KEYRING_PATH": os.path.join(work_dir, "keyring.json"),
+                "AWS_JUMPCLOUD_STATE_DIR": os.path.join(work_dir, "state")})
+    profile_names = [f"profile-{i}" for i in range(args.profiles)]
+    _run_cli_setup(env, upstream, profile_names)
+    if args.warm:
+        for name in profile_names:
+            _run([sys.executable, "-c", CLI, "exec", name, "--", "true"], env)
+    upstream.counts.clear()
+
+    print(f"Starting {args.processes} processes across {args.profiles} profiles...")
+    started_at = time.time()
+    latencies, failures = _stress(env, profile_names, args.processes)
+    wall_time = max(latencies) if latencies else 0
+    _report(args, env, upstream, profile_names, latencies, failures, wall_time, started_at)
+    upstream.stop()
+
+
+def _run_cli_setup(env, upstream, profile_names):
+    # Stores JumpCloud credentials and profiles in the file-backed keyring,
+    # in a child process so that this process never loads a keyring backend
+    code = "\n".join([
+        "import sys",
+        "from aws_jumpcloud.keyring import Keyring",
+        "from aws_jumpcloud.profile import Profile",
+        "k = Keyring()",
+        "k.store_jumpcloud_email('stress@example.com')",
+        "k.store_jumpcloud_password('password')",
+        "for (name, url) in zip(sys.argv[1::2], sys.argv[2::2]):",
+        "    k.store_profile(Profile(name, url))"])
+    argv = []
+    for name in profile_names:
+        argv += [name, upstream.sso_url(name)]
+    _run([sys.executable, "-c", code] + argv, env)
+
+
+def _stress(env, profile_names, count):
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+    start = time.monotonic()
+
+    def run(i):
+        name = profile_names[i % len(profile_names)]
+        proc = subprocess.Popen([sys.executable, "-c", CLI, "exec", name, "--", "true"], env=env,
+                                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        stderr = proc.communicate()[1]
+        with lock:
+            latencies.append(time.monotonic() - start)
+            if proc.returncode != 0:
+                failures.append((name, proc.returncode, stderr.decode("utf-8", "replace").strip()))
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, failures
+
+
+def _report(args, env, upstream, profile_names, latencies, failures, wall_time, started_at):
+    stats = _read_child_metrics(env, started_at)
+    stored_sessions = _count_stored_sessions(env, profile_names)
+    print("")
+    print(f"Processes:              {args.processes} ({len(failures)} failed)")
+    print(f"Wall time:              {wall_time:.2f}s")
+    print(f"Throughput:             {args.processes / wall_time:.1f} processes/s")
+    for p in [50, 95, 99, 100]:
+        print(f"Latency p{p:<3}:           {_percentile(latencies, p):.2f}s")
+    print(f"JumpCloud logins:       {upstream.counts['jumpcloud_login']}")
+    print(f"SAML assertions:        {upstream.counts['jumpcloud_saml']}")
+    print(f"STS AssumeRoleWithSAML: {upstream.counts['AssumeRoleWithSAML']}")
+    print(f"Keychain writes:        {stats['keychain_write']}")
+    print(f"Keychain conflicts:     {stats['keychain_conflict']} (detected and retried)")
+    print(f"Profiles with sessions: {stored_sessions} of {len(profile_names)} "
+          f"({len(profile_names) - stored_sessions} lost)")
+    for (name, returncode, stderr) in failures[:5]:
+        print(f"\n{name} exited with {returncode}:\n{stderr}")
+
+
+def _read_child_metrics(env, since):
+    counts = {"keychain_write": 0, "keychain_conflict": 0}
+    code = "\n".join([
+        "import sys",
+        "import aws_jumpcloud.metrics as metrics",
+        "for r in metrics.read_records(since=float(sys.argv[1])):",
+        "    print(r['phase'])"])
+    for phase in _run([sys.executable, "-c", code, str(since)], env).split():
+        if phase in counts:
+            counts[phase] += 1
+    return counts
+
+
+def _count_stored_sessions(env, profile_names):
+    code = "\n".join([
+        "import os",
+        "os.environ['AWS_JUMPCLOUD_METRICS'] = '0'",
+        "from aws_jumpcloud.keyring import Keyring",
+        "print(len(Keyring().get_all_sessions()))"])
+    return int(_run([sys.executable, "-c", code], env).strip())
+
+
+def _run(command, env):
+    result = subprocess.run(command, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr.decode("utf-8", "replace"))
+        sys.exit(result.returncode)
+    return result.stdout.decode("utf-8")
+
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)] if ordered else 0
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Compares the built-in STS/IAM client with boto3 on the login path: how long
+a fresh process takes to import what it needs, how long the requests take,
+and how much memory the process uses.
+
+Each run is a separate process that imports aws_jumpcloud.aws, then calls
+AssumeRoleWithSAML, AssumeRole and ListAccountAliases against a local fake
+STS/IAM server (fake_upstream.py), so no real AWS account is needed. boto3
+is only imported when the first request is made, so with boto3 its import
+time shows up under "Calls":
+
+    $ python3 benchmarks/sts_client.py --runs=10
+"""
+from argparse import ArgumentParser
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from fake_upstream import AWS_ACCOUNT_ID, ROLE_NAME, SAML_ASSERTION, FakeUpstream  # noqa: E402
+
+CHILD = "\n".join([
+    "import json, resource, sys, time",
+    "started_at = time.perf_counter()",
+    "from aws_jumpcloud import aws",
+    "from aws_jumpcloud.profile import AssumedRole",
+    "from aws_jumpcloud.saml import SAMLRole",
+    "from aws_jumpcloud.sts_endpoints import STSEndpoint",
+    "imported_at = time.perf_counter()",
+    "(url, role_arn, principal_arn, assertion) = sys.argv[1:5]",
+    "endpoints = [STSEndpoint('us-east-1', url)]",
+    "session = aws.assume_role_with_saml(SAMLRole(role_arn, principal_arn), assertion.encode('utf-8'),",
+    "                                    endpoints)",
+    "role = AssumedRole(role_arn.split(':')[4], 'Benchmark', None)",
+    "aws.assume_role(session, role, 'benchmark', endpoints)",
+    "alias = aws.get_account_alias(session)",
+    "assert(alias == 'fake-account')",
+    "finished_at = time.perf_counter()",
+    "print(json.dumps({'import': imported_at - started_at, 'calls': finished_at - imported_at,",
+    "                  'maxrss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))"])
+
+MODES = [("built-in", "0"), ("boto3", "1")]
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=10, help="processes per client (default: 10)")
+    parser.add_argument("--upstream-latency", type=float, default=0, metavar="MS",
+                        help="delay added to every fake upstream response (default: 0)")
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(latency=args.upstream_latency / 1000).start()
+    env = dict(os.environ, **upstream.environment())
+    env.update({"PYTHONPATH": REPO_DIR, "AWS_JUMPCLOUD_METRICS": "0"})
+    assertion = SAML_ASSERTION.format(not_before="2000-01-01T00:00:00Z",
+                                      not_on_or_after="2100-01-01T00:00:00Z")
+    argv = [upstream.url, f"arn:aws:iam::{AWS_ACCOUNT_ID}:role/{ROLE_NAME}",
+            f"arn:aws:iam::{AWS_ACCOUNT_ID}:saml-provider/JumpCloud", assertion]
+
+    print(f"{'Client':<10}{'Import (ms)':>14}{'Calls (ms)':>14}{'Total (ms)':>14}{'Max RSS (MB)':>16}")
+    for (name, use_boto3) in MODES:
+        results = [_run(argv, dict(env, AWS_JUMPCLOUD_USE_BOTO3=use_boto3)) for _ in range(args.runs)]
+        import_ms = statistics.median([r["import"] for r in results]) * 1000
+        calls_ms = statistics.median([r["calls"] for r in results]) * 1000
+        total_ms = statistics.median([r["import"] + r["calls"] for r in results]) * 1000
+        maxrss_mb = statistics.median([r["maxrss"] for r in results]) / _rss_units_per_mb()
+        print(f"{name:<10}{import_ms:>14.0f}{calls_ms:>14.0f}{total_ms:>14.0f}{maxrss_mb:>16.1f}")
+    upstream.stop()
+
+
+def _run(argv, env):
+    result = subprocess.run([sys.executable, "-c", CHILD] + argv, env=env, stdin=subprocess.DEVNULL,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr.decode("utf-8", "replace"))
+        sys.exit(result.returncode)
+    return json.loads(result.stdout.decode("utf-8"))
+
+
+def _rss_units_per_mb():
+    # ru_maxrss is in bytes on macOS, and kilobytes on Linux
+    return 1024 * 1024 if sys.platform == "darwin" else 1024
+
+
+if __name__ == "__main__":
+    main()
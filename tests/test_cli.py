@@ -0,0 +1,71 @@
+import unittest
+
+from aws_jumpcloud.cli import _parse_args
+
+
+class TestExecArguments(unittest.TestCase):
+    def test_profile_then_command(self):
+        (_, args) = _parse_args(["exec", "duff", "--", "aws", "s3", "ls"])
+        self.assertEqual(args.profile, "duff")
+        self.assertEqual(args.command, ["aws", "s3", "ls"])
+
+    def test_options_after_profile(self):
+        (_, args) = _parse_args(["exec", "duff", "--rotate", "--", "terraform", "apply"])
+        self.assertEqual(args.profile, "duff")
+        self.assertTrue(args.rotate)
+        self.assertEqual(args.command, ["terraform", "apply"])
+
+        (_, args) = _parse_args(["exec", "duff", "--max-staleness", "0", "--", "aws", "--version"])
+        self.assertEqual(args.profile, "duff")
+        self.assertEqual(args.max_staleness, "0")
+        self.assertEqual(args.command, ["aws", "--version"])
+
+    def test_options_before_profile(self):
+        (_, args) = _parse_args(["exec", "--max-staleness=0", "duff", "--", "aws", "s3", "ls"])
+        self.assertEqual(args.profile, "duff")
+        self.assertEqual(args.max_staleness, "0")
+        self.assertEqual(args.command, ["aws", "s3", "ls"])
+
+    def test_all_profiles(self):
+        (_, args) = _parse_args(["exec", "--all", "--jobs=16", "--", "aws"])
+        self.assertTrue(args.all)
+        self.assertIsNone(args.profile)
+        self.assertEqual(args.command, ["aws"])
+
+    def test_listed_profiles(self):
+        (_, args) = _parse_args(["exec", "--profiles=duff,duff-deployer", "--", "aws", "--all"])
+        self.assertEqual(args.profiles, "duff,duff-deployer")
+        self.assertFalse(args.all)
+        self.assertIsNone(args.profile)
+        self.assertEqual(args.command, ["aws", "--all"])
+
+    def test_option_values_before_all(self):
+        (_, args) = _parse_args(["exec", "--jobs", "4", "--all", "--", "aws"])
+        self.assertTrue(args.all)
+        self.assertEqual(args.jobs, 4)
+        self.assertEqual(args.command, ["aws"])
+
+    def test_command_arguments_not_taken_as_all(self):
+        # The command's own --all mustn't run it for every profile
+        with self.assertRaises(SystemExit):
+            _parse_args(["exec", "duff", "docker", "ps", "--all"])
+        with self.assertRaises(SystemExit):
+            _parse_args(["exec", "duff", "aws", "--profiles=a,b"])
+
+        (_, args) = _parse_args(["exec", "duff", "--", "docker", "ps", "--all"])
+        self.assertEqual(args.profile, "duff")
+        self.assertFalse(args.all)
+        self.assertEqual(args.command, ["docker", "ps", "--all"])
+
+    def test_jobs_must_be_positive(self):
+        for jobs in ["0", "-1", "many"]:
+            with self.assertRaises(SystemExit):
+                _parse_args(["exec", "--all", "--jobs", jobs, "--", "aws"])
+
+    def test_profile_required(self):
+        with self.assertRaises(SystemExit):
+            _parse_args(["exec", "--rotate", "--", "aws"])
+
+
+if __name__ == "__main__":
+    unittest.main()
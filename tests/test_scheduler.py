@@ -0,0 +1,82 @@
+import unittest
+from unittest import mock
+
+from aws_jumpcloud.query_client import AWSRequestError
+from aws_jumpcloud.scheduler import MAX_ATTEMPTS, MAX_SERVER_ERROR_ATTEMPTS, Scheduler, TokenBucket
+
+# High enough that the rate limit never delays these tests, even once it has
+# been halved for each throttling error
+RATE_LIMITS = {"sts": 1000000.0}
+ENDPOINT = "https://sts.amazonaws.com"
+
+
+class FailingCall(object):
+    """Raises the given errors, one per call, then returns "ok"."""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+@mock.patch("aws_jumpcloud.scheduler.time.sleep")
+class TestSchedulerRetries(unittest.TestCase):
+    def test_server_errors_give_up_after_a_few_attempts(self, sleep):
+        call = FailingCall([AWSRequestError("ServiceUnavailable", None, 503)] * MAX_ATTEMPTS)
+        with self.assertRaises(AWSRequestError):
+            Scheduler(RATE_LIMITS).call("sts", ENDPOINT, call)
+        self.assertEqual(call.calls, MAX_SERVER_ERROR_ATTEMPTS)
+
+    def test_server_error_then_success(self, sleep):
+        errors = [AWSRequestError("InternalFailure", None, 500)] * (MAX_SERVER_ERROR_ATTEMPTS - 1)
+        call = FailingCall(errors)
+        self.assertEqual(Scheduler(RATE_LIMITS).call("sts", ENDPOINT, call), "ok")
+        self.assertEqual(call.calls, MAX_SERVER_ERROR_ATTEMPTS)
+
+    def test_throttling_retried_for_longer(self, sleep):
+        errors = [AWSRequestError("Throttling", "Rate exceeded", 400)] * (MAX_ATTEMPTS - 1)
+        call = FailingCall(errors)
+        self.assertEqual(Scheduler(RATE_LIMITS).call("sts", ENDPOINT, call), "ok")
+        self.assertEqual(call.calls, MAX_ATTEMPTS)
+
+    def test_other_errors_not_retried(self, sleep):
+        call = FailingCall([AWSRequestError("AccessDenied", None, 403)])
+        with self.assertRaises(AWSRequestError):
+            Scheduler(RATE_LIMITS).call("sts", ENDPOINT, call)
+        self.assertEqual(call.calls, 1)
+
+
+class FakeClock(object):
+    """Stands in for the time module, advancing only when something sleeps."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = 0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps += 1
+        if self.sleeps > 100:
+            raise AssertionError("still waiting after 100 sleeps")
+        self.now += seconds
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_rate_below_one_per_second_still_refills(self):
+        with mock.patch("aws_jumpcloud.scheduler.time", FakeClock()):
+            bucket = TokenBucket(4.0)
+            for _ in range(3):
+                bucket.slow_down()
+            self.assertEqual(bucket.rate, 0.5)
+            self.assertEqual([bucket.acquire() for _ in range(3)], [0.0, 2.0, 2.0])
+
+
+if __name__ == "__main__":
+    unittest.main()